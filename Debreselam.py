@@ -5,22 +5,100 @@ Complete solution for students, teachers, and parents
 """
 
 import os
+import re
+import math
+import bisect
+import heapq
 import logging
 import time
 import random
-from datetime import datetime
+import asyncio
+import unicodedata
+import contextvars
+import copy
+import gzip
+import json
+import hashlib
+import io
+import cProfile
+import pstats
+import tempfile
+import tracemalloc
+import shutil
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from telegram import (
     InlineKeyboardButton, InlineKeyboardMarkup, Update,
     KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 )
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
-    MessageHandler, filters, ContextTypes
+    MessageHandler, TypeHandler, BaseUpdateProcessor, filters, ContextTypes
 )
+from telegram.error import TelegramError
+
+try:
+    from PIL import Image  # optional: thumbnails are skipped without Pillow
+except ImportError:
+    Image = None
+
+try:
+    from reportlab.pdfgen import canvas as pdf_canvas  # optional: PDF exports need reportlab
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+except ImportError:
+    pdf_canvas = None
 
 # ==================== CONFIGURATION ====================
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 DEVELOPER_NAME = "Sunday School Management System"
+SEARCH_RESULT_LIMIT = 10
+SEARCH_MAX_PREFIX_TERMS = 200
+TENANT_IDS = [t.strip() for t in os.getenv("TENANTS", "default").split(",") if t.strip()]
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", TENANT_IDS[0])
+TENANT_RATE_PER_SECOND = float(os.getenv("TENANT_RATE_PER_SECOND", "15"))
+TENANT_BURST = int(os.getenv("TENANT_BURST", "40"))
+# Optional per-tenant join codes, e.g. "st_mary=4821,st_george=1907"
+TENANT_JOIN_CODES = dict(item.strip().split("=", 1) for item in os.getenv("TENANT_JOIN_CODES", "").split(",")
+                         if "=" in item)
+TENANT_MAX_WAITING = 50  # updates a tenant may have queued before new ones are turned away
+TENANT_CONCURRENCY = 16  # updates of one tenant running at once
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_SECONDS = int(os.getenv("BACKUP_INTERVAL_SECONDS", "900"))
+BACKUP_FULL_EVERY = 24  # snapshots between full backups
+BACKUP_MAX_BYTES_PER_SECOND = 512 * 1024
+BACKUP_CHUNK_SIZE = 64 * 1024
+BACKUP_EXPORT_SLICE = 200  # records deep-copied between yields to the event loop
+# Quiz questions, materials and the schedule live in CONTENT_DIR, not in backups
+BACKUP_RECORD_COLLECTIONS = ("users", "submissions", "chat_tenants")
+BACKUP_LOG_COLLECTIONS = ("shared_contacts", "homework", "change_log")
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = 900
+PROFILE_TOP_N = 30
+PROFILE_TRACEMALLOC_FRAMES = 5
+SUBMISSION_DIR = os.getenv("SUBMISSION_DIR", "submissions")
+SUBMISSION_WORKERS = 4
+SUBMISSION_QUEUE_SIZE = 200
+SUBMISSION_MAX_BYTES = 20 * 1024 * 1024  # Bot API download limit
+THUMBNAIL_SIZE = (320, 320)
+REVIEW_PAGE_SIZE = 5
+PROCESS_POOL_WORKERS = 2
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+# Built-in PDF fonts have no Ge'ez glyphs; point this at a TTF such as Noto Sans Ethiopic
+REPORT_PDF_FONT = os.getenv("REPORT_PDF_FONT", "")
+CONTENT_DIR = os.getenv("CONTENT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "content"))
+CONTENT_POLL_SECONDS = int(os.getenv("CONTENT_POLL_SECONDS", "5"))
+# Opt-in traffic capture for replay (see replay.py), e.g. TRAFFIC_LOG=traffic.jsonl.gz
+TRAFFIC_LOG = os.getenv("TRAFFIC_LOG", "")
+TRAFFIC_SALT = os.getenv("TRAFFIC_SALT", "")
+TRAFFIC_FLUSH_EVERY = 50
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "18"))
+DIGEST_WEEKLY_DAY = 6  # Sunday
+DIGEST_WINDOW_SECONDS = int(os.getenv("DIGEST_WINDOW_SECONDS", "1800"))
+DIGEST_MAX_PER_SECOND = 20
+DIGEST_MAX_PENDING = 50  # newest changes kept per child until the parent links a chat
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -43,7 +121,119 @@ class LanguageManager:
     def get_language(self, user_id):
         return self.user_languages.get(user_id, "en")
 
-language_manager = LanguageManager()
+# ==================== SEARCH INDEX ====================
+# Ethiopic punctuation (፡ ። ፣ ፤ ፥ ፦ ፧ ፨) is not matched by \w, so Ge'ez words
+# split on it just like Latin words split on spaces and commas.
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """Split Latin or Ge'ez text into normalized search tokens"""
+    text = unicodedata.normalize("NFC", str(text)).casefold()
+    return TOKEN_PATTERN.findall(text)
+
+class SearchIndex:
+    """In-memory inverted index with prefix lookup over a sorted term list"""
+
+    def __init__(self):
+        self.postings = {}   # term -> {doc_id: term count}
+        self.terms = []      # sorted terms, used for prefix ranges
+        self.documents = {}  # doc_id -> {"kind", "title", "detail", "terms", "length"}
+
+    @staticmethod
+    def term_counts(title, detail="", extra_text=""):
+        counts = {}
+        for token in tokenize(f"{title} {detail} {extra_text}"):
+            counts[token] = counts.get(token, 0) + 1
+        return counts
+
+    def add(self, doc_id, kind, title, detail="", extra_text="", counts=None):
+        """Index a document; counts may be precomputed off the event loop"""
+        if doc_id in self.documents:
+            self.remove(doc_id)
+
+        if counts is None:
+            counts = self.term_counts(title, detail, extra_text)
+
+        for term, count in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[doc_id] = count
+
+        self.documents[doc_id] = {
+            "kind": kind, "title": title, "detail": detail,
+            "terms": list(counts), "length": sum(counts.values())
+        }
+
+    def remove(self, doc_id):
+        document = self.documents.pop(doc_id, None)
+        if not document:
+            return False
+
+        for term in document["terms"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                index = bisect.bisect_left(self.terms, term)
+                if index < len(self.terms) and self.terms[index] == term:
+                    del self.terms[index]
+        return True
+
+    def _prefix_terms(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        for term in self.terms[start:start + SEARCH_MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def search(self, query, kinds=None, limit=SEARCH_RESULT_LIMIT):
+        """Return documents matching every query token, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for term in self._prefix_terms(token):
+                # Exact matches outrank prefix matches; rare terms outrank common ones
+                weight = 2.0 if term == token else 1.0
+                posting = self.postings[term]
+                idf = math.log(1 + len(self.documents) / len(posting))
+                for doc_id, count in posting.items():
+                    token_scores[doc_id] = max(token_scores.get(doc_id, 0), weight * idf * count)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: score + token_scores[doc_id]
+                          for doc_id, score in scores.items() if doc_id in token_scores}
+            if not scores:
+                return []
+
+        results = []
+        for doc_id, score in scores.items():
+            document = self.documents[doc_id]
+            if kinds and document["kind"] not in kinds:
+                continue
+            results.append((score / math.sqrt(document["length"]), doc_id, document))
+
+        # Only the top few are shown, so avoid sorting every match
+        results = heapq.nsmallest(limit, results, key=lambda item: (-item[0], item[2]["title"]))
+        return [{"id": doc_id, "score": score, "kind": document["kind"],
+                 "title": document["title"], "detail": document["detail"]}
+                for score, doc_id, document in results]
+
+def material_document(class_name, index, material):
+    return (f"material:{class_name}:{index}", "material", material, class_name, "")
+
+def question_document(subject, index, question):
+    return (f"question:{subject}:{index}", "question", question["question"],
+            subject.title(), " ".join(question["options"]))
 
 # ==================== SIMPLE DATABASE ====================
 class SimpleDB:
@@ -63,24 +253,89 @@ class SimpleDB:
             
             "ADM5001": {"name": "Mr. Daniel G/Michael", "password": "admin123", 
                        "role": "admin", "password_changed": False, "contact": ""},
+            
+            "PAR2001": {"name": "ወ/ሮ አልማዝ ተስፋዬ", "password": "parent123", 
+                       "role": "parent", "password_changed": False, "contact": "",
+                       "children": ["STS0001"], "digest": "daily", "chat_id": None},
         }
         
         self.shared_contacts = []
-        self.quiz_questions = {
-            "bible": [
-                {"question": "Who built the ark?", "options": ["Moses", "Noah", "David", "Abraham"], "answer": "Noah"},
-                {"question": "How many books in the New Testament?", "options": ["27", "39", "66", "12"], "answer": "27"},
-            ],
-            "math": [
-                {"question": "What is 2 + 2?", "options": ["3", "4", "5", "6"], "answer": "4"},
-                {"question": "What is 5 × 3?", "options": ["10", "15", "20", "25"], "answer": "15"},
-            ],
-        }
+        self.homework = []
+        self.submissions = {}  # str(id) -> submission, kept as a dict for backups
+        self.chat_tenants = {}  # str(chat id) -> tenant id; only used in the default tenant
+        self.change_log = []
+        self.digest_cursor = 0
+        self.pending_digests = {}
+        # Bumped whenever a class's grades or attendance change; keys the report cache
+        self.report_versions = {}
+        self.data_epoch = 0
+        # Filled from CONTENT_DIR by ContentWatcher and swapped on reload
+        self.quiz_questions = {}
+        self.quiz_titles = {}
+        self.study_materials = {}
+        self.schedule = []
         self.quizzes = {}
-        self.study_materials = {
-            "ቀዳማይ": ["Bible Stories", "Basic Math", "Alphabet"],
-            "ካልኣይ": ["Bible Verses", "Addition/Subtraction", "Simple Sentences"],
-        }
+        
+        # Keys written since the last backup, and how far each log was backed up
+        self.dirty = {collection: set() for collection in BACKUP_RECORD_COLLECTIONS}
+        self.log_offsets = {log: 0 for log in BACKUP_LOG_COLLECTIONS}
+        self.meta_dirty = False  # digest cursor or pending digests moved
+        
+        self._rebuild_search_index()
+    
+    # ---------- search index maintenance ----------
+    def _rebuild_search_index(self):
+        self.search_index = SearchIndex()
+        for user_id in self.users:
+            self._index_user(user_id)
+        for class_name, materials in self.study_materials.items():
+            for i in range(len(materials)):
+                self._index_material(class_name, i)
+        for subject, questions in self.quiz_questions.items():
+            for i in range(len(questions)):
+                self._index_question(subject, i)
+    
+    def _index_user(self, user_id):
+        user = self.users[user_id]
+        detail = user.get("class") or user.get("subject") or user["role"].title()
+        self.search_index.add(f"user:{user_id}", "user", user["name"], detail, user_id)
+    
+    def _index_material(self, class_name, index):
+        self.search_index.add(*material_document(class_name, index, self.study_materials[class_name][index]))
+    
+    def _index_question(self, subject, index):
+        self.search_index.add(*question_document(subject, index, self.quiz_questions[subject][index]))
+    
+    def search(self, query, kinds=None):
+        return self.search_index.search(query, kinds=kinds)
+    
+    # ---------- content reloads ----------
+    # Each method replaces one key with a new list instead of mutating the old one,
+    # so running quizzes keep the questions they were started with.
+    def replace_materials(self, class_name, materials, documents):
+        for i in range(len(self.study_materials.get(class_name, []))):
+            self.search_index.remove(f"material:{class_name}:{i}")
+        if materials is None:
+            self.study_materials.pop(class_name, None)
+        else:
+            self.study_materials[class_name] = materials
+        for document in documents:
+            self.search_index.add(*document)
+    
+    def replace_quiz_subject(self, subject, title, questions, documents):
+        for i in range(len(self.quiz_questions.get(subject, []))):
+            self.search_index.remove(f"question:{subject}:{i}")
+        if questions is None:
+            self.quiz_questions.pop(subject, None)
+            self.quiz_titles.pop(subject, None)
+        else:
+            self.quiz_questions[subject] = questions
+            self.quiz_titles[subject] = title
+        for document in documents:
+            self.search_index.add(*document)
+    
+    def replace_schedule(self, schedule):
+        self.schedule = schedule
     
     def get_user(self, user_id):
         user_id = user_id.upper().strip()
@@ -96,6 +351,7 @@ class SimpleDB:
         if user_id in self.users:
             self.users[user_id]["password"] = new_password
             self.users[user_id]["password_changed"] = True
+            self._mark_dirty("users", user_id)
             return True
         return False
     
@@ -106,6 +362,7 @@ class SimpleDB:
     def update_contact(self, user_id, contact_info):
         if user_id in self.users:
             self.users[user_id]["contact"] = contact_info
+            self._mark_dirty("users", user_id)
             return True
         return False
     
@@ -127,6 +384,7 @@ class SimpleDB:
         self.quizzes[quiz_id] = {
             "user_id": user_id,
             "subject": subject,
+            # This quiz's own snapshot: content reloads swap in new lists, never mutate these
             "questions": random.sample(questions, min(2, len(questions))),
             "current_question": 0,
             "score": 0,
@@ -180,13 +438,717 @@ class SimpleDB:
             "time_taken": time.time() - quiz["start_time"],
             "answers": quiz["answers"]
         }
+    
+    # ---------- grades, attendance and homework ----------
+    def _log_change(self, change_type, detail, student_id=None, class_name=None):
+        self.change_log.append({
+            "type": change_type,
+            "student_id": student_id,
+            "class": class_name,
+            "detail": detail,
+            "timestamp": time.time(),
+            "date": datetime.now().strftime("%Y-%m-%d")
+        })
+    
+    def set_grade(self, student_id, subject, grade):
+        student = self.users.get(student_id)
+        if not student or student["role"] != "student":
+            return False
+        grades = student.setdefault("grades", {})
+        if grades.get(subject) == grade:
+            return True
+        grades[subject] = grade
+        self._mark_dirty("users", student_id)
+        self._bump_report_version(student.get("class"))
+        self._log_change("grade", {"subject": subject, "grade": grade}, student_id=student_id)
+        return True
+    
+    def record_attendance(self, student_id, present=True):
+        student = self.users.get(student_id)
+        if not student or student["role"] != "student":
+            return False
+        today = datetime.now().strftime("%Y-%m-%d")
+        days = student.setdefault("attendance_days", {})
+        # Repeat taps on the same day must not send parents the same line twice
+        if days.get(today) == present:
+            return True
+        days[today] = present
+        self._mark_dirty("users", student_id)
+        self._bump_report_version(student.get("class"))
+        self._log_change("attendance", {"present": present}, student_id=student_id)
+        return True
+    
+    # ---------- reports ----------
+    def _bump_report_version(self, class_name):
+        self.report_versions[class_name] = self.report_versions.get(class_name, 0) + 1
+    
+    def get_report_version(self, class_name):
+        return self.data_epoch, self.report_versions.get(class_name, 0)
+    
+    def get_grade_subjects(self):
+        return sorted({subject for _, student in self.get_students() for subject in student.get("grades", {})})
+    
+    def match_grade_subject(self, subject):
+        """Map e.g. "Mathematics" or "math" onto the grade key already in use ("Math")"""
+        known = self.get_grade_subjects()
+        if not known:
+            return subject
+        wanted = subject.casefold()
+        for key in known:
+            if key.casefold() == wanted:
+                return key
+        for key in known:
+            if wanted.startswith(key.casefold()) or key.casefold().startswith(wanted):
+                return key
+        return None
+    
+    def get_students(self):
+        return [(user_id, user) for user_id, user in sorted(self.users.items())
+                if user["role"] == "student"]
+    
+    def get_classes(self):
+        return sorted({user["class"] for user in self.users.values()
+                       if user["role"] == "student" and user.get("class")})
+    
+    def get_class_report_data(self, class_name):
+        """Plain, picklable rows for the report renderers"""
+        students = []
+        for user_id, user in sorted(self.users.items()):
+            if user["role"] != "student" or user.get("class") != class_name:
+                continue
+            days = user.get("attendance_days", {})
+            students.append({
+                "id": user_id,
+                "name": user["name"],
+                "grades": dict(user.get("grades", {})),
+                "attendance": dict(user.get("attendance", {})),
+                "days_present": sum(1 for present in days.values() if present),
+                "days_recorded": len(days)
+            })
+        subjects = sorted({subject for student in students for subject in student["grades"]})
+        return subjects, students
+    
+    def assign_homework(self, class_name, subject, teacher_id):
+        homework = {
+            "id": len(self.homework) + 1,
+            "class": class_name,
+            "subject": subject,
+            "teacher_id": teacher_id,
+            "date": datetime.now().strftime("%Y-%m-%d")
+        }
+        self.homework.append(homework)
+        self._log_change("homework", {"subject": subject}, class_name=class_name)
+        return homework
+    
+    def get_open_homework(self, class_name, limit=5):
+        return [hw for hw in self.homework if hw["class"] == class_name][-limit:]
+    
+    def get_homework(self, homework_id):
+        for homework in self.homework:
+            if homework["id"] == homework_id:
+                return homework
+        return None
+    
+    # ---------- homework submissions ----------
+    def add_submission(self, homework_id, student_id, content_hash, file_id, kind, file_name,
+                       thumbnail=None):
+        """Store a submission; returns (submission, is_duplicate)"""
+        for submission in self.submissions.values():
+            if (submission["homework_id"] == homework_id and submission["student_id"] == student_id
+                    and submission["content_hash"] == content_hash):
+                return submission, True
+        
+        submission_id = str(len(self.submissions) + 1)
+        submission = {
+            "id": submission_id,
+            "homework_id": homework_id,
+            "student_id": student_id,
+            "content_hash": content_hash,
+            "file_id": file_id,
+            "kind": kind,
+            "file_name": file_name,
+            "thumbnail": thumbnail,
+            "reviewed": False,
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M")
+        }
+        self.submissions[submission_id] = submission
+        self._mark_dirty("submissions", submission_id)
+        return submission, False
+    
+    def _teacher_homework_ids(self, teacher_id):
+        return {hw["id"] for hw in self.homework if hw["teacher_id"] == teacher_id}
+    
+    def get_teacher_submission(self, submission_id, teacher_id):
+        """A submission, but only if it answers homework this teacher assigned"""
+        submission = self.submissions.get(submission_id)
+        if not submission or submission["homework_id"] not in self._teacher_homework_ids(teacher_id):
+            return None
+        return submission
+    
+    def get_review_queue(self, teacher_id, page, page_size):
+        """Unreviewed submissions for this teacher's homework, oldest first"""
+        homework_ids = self._teacher_homework_ids(teacher_id)
+        pending = [sub for sub in self.submissions.values()
+                   if sub["homework_id"] in homework_ids and not sub["reviewed"]]
+        start = page * page_size
+        return pending[start:start + page_size], len(pending)
+    
+    def mark_reviewed(self, submission_id):
+        submission = self.submissions.get(submission_id)
+        if not submission:
+            return False
+        submission["reviewed"] = True
+        self._mark_dirty("submissions", submission_id)
+        return True
+    
+    # ---------- parents ----------
+    def get_children(self, parent_id):
+        parent = self.users.get(parent_id)
+        if not parent or parent["role"] != "parent":
+            return []
+        return [(child_id, self.users[child_id]) for child_id in parent.get("children", [])
+                if child_id in self.users]
+    
+    def link_chat(self, user_id, chat_id):
+        if user_id in self.users:
+            self.users[user_id]["chat_id"] = chat_id
+            self._mark_dirty("users", user_id)
+            return True
+        return False
+    
+    def set_digest_frequency(self, parent_id, frequency):
+        parent = self.users.get(parent_id)
+        if not parent or parent["role"] != "parent" or frequency not in ("daily", "weekly"):
+            return False
+        parent["digest"] = frequency
+        self._mark_dirty("users", parent_id)
+        return True
+    
+    def collect_digests(self, include_weekly=False):
+        """Fold new changes into parents' pending digests and return the ones due"""
+        events = self.change_log[self.digest_cursor:]
+        self.digest_cursor = len(self.change_log)
+        if events:
+            self.meta_dirty = True
+        
+        # One pass over the day's changes, grouped by who they concern
+        by_student = {}
+        by_class = {}
+        for event in events:
+            if event["student_id"]:
+                by_student.setdefault(event["student_id"], []).append(event)
+            else:
+                by_class.setdefault(event["class"], []).append(event)
+        
+        due = []
+        for parent_id, parent in self.users.items():
+            if parent["role"] != "parent":
+                continue
+            
+            pending = self.pending_digests.setdefault(parent_id, {})
+            for child_id, child in self.get_children(parent_id):
+                child_events = by_student.get(child_id, []) + by_class.get(child.get("class"), [])
+                if child_events:
+                    child_events.sort(key=lambda event: event["timestamp"])
+                    pending[child_id] = (pending.get(child_id, []) + child_events)[-DIGEST_MAX_PENDING:]
+            
+            if parent.get("digest", "daily") == "weekly" and not include_weekly:
+                continue
+            if pending and parent.get("chat_id"):
+                due.append((parent_id, parent, self.pending_digests.pop(parent_id)))
+                self.meta_dirty = True
+        return due
+    
+    # ---------- tenants ----------
+    def get_chat_tenant(self, chat_id):
+        return self.chat_tenants.get(str(chat_id))
+    
+    def set_chat_tenant(self, chat_id, tenant_id):
+        # Moving back to the default school is stored too; incremental backups cannot delete keys
+        self.chat_tenants[str(chat_id)] = tenant_id
+        self._mark_dirty("chat_tenants", str(chat_id))
+    
+    # ---------- backups ----------
+    def _mark_dirty(self, collection, key):
+        self.dirty[collection].add(key)
+    
+    def _trim_change_log(self):
+        """Drop digested changes; only safe when a full export starts a new backup chain"""
+        if self.digest_cursor:
+            del self.change_log[:self.digest_cursor]
+            self.digest_cursor = 0
+    
+    async def export_changes(self, full=False):
+        """Copy what changed since the last export, yielding to handlers between slices"""
+        if full:
+            self._trim_change_log()
+        
+        # Log entries are never modified once appended, so sharing them with the writer is safe
+        logs = {}
+        for log in BACKUP_LOG_COLLECTIONS:
+            entries = getattr(self, log)
+            logs[log] = entries[0 if full else self.log_offsets[log]:]
+            self.log_offsets[log] = len(entries)
+        meta = {
+            "digest_cursor": self.digest_cursor,
+            "pending_digests": copy.deepcopy(self.pending_digests)
+        }
+        self.meta_dirty = False
+        
+        records = {}
+        for collection in BACKUP_RECORD_COLLECTIONS:
+            source = getattr(self, collection)
+            keys = list(source) if full else list(self.dirty[collection])
+            # Cleared up front: a record written mid-export is marked again for the next one
+            self.dirty[collection] = set()
+            copied = records[collection] = {}
+            for start in range(0, len(keys), BACKUP_EXPORT_SLICE):
+                for key in keys[start:start + BACKUP_EXPORT_SLICE]:
+                    if key in source:
+                        copied[key] = copy.deepcopy(source[key])
+                await asyncio.sleep(0)
+        
+        return {"full": full, "records": records, "logs": logs, "meta": meta}
+    
+    def has_changes(self):
+        return (self.meta_dirty or any(self.dirty.values()) or
+                any(len(getattr(self, log)) > self.log_offsets[log] for log in BACKUP_LOG_COLLECTIONS))
+    
+    def load_state(self, state):
+        """Replace persisted data with a restored snapshot chain"""
+        for collection in BACKUP_RECORD_COLLECTIONS:
+            setattr(self, collection, state["records"].get(collection, {}))
+            self.dirty[collection] = set()
+        for log in BACKUP_LOG_COLLECTIONS:
+            setattr(self, log, state["logs"][log])
+            self.log_offsets[log] = len(state["logs"][log])
+        self.digest_cursor = state["meta"]["digest_cursor"]
+        self.pending_digests = state["meta"]["pending_digests"]
+        self.meta_dirty = False
+        self.data_epoch += 1
+        self._rebuild_search_index()
+
+# ==================== BACKUPS ====================
+class BackupManager:
+    """Incremental, compressed, checksummed snapshots of one SimpleDB"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.force_full = True
+        self.lock = asyncio.Lock()
+    
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"snapshots": []}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+    
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+    
+    def _write_snapshot(self, changes):
+        """Runs in a worker thread; writes are throttled to spare live handlers"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.load_manifest()
+        snapshots = manifest["snapshots"]
+        snapshot_id = snapshots[-1]["id"] + 1 if snapshots else 1
+        
+        payload = gzip.compress(json.dumps(changes, ensure_ascii=False).encode("utf-8"))
+        file_name = f"snapshot_{snapshot_id:06d}.json.gz"
+        tmp_path = os.path.join(self.directory, file_name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(payload), BACKUP_CHUNK_SIZE):
+                f.write(payload[start:start + BACKUP_CHUNK_SIZE])
+                time.sleep(BACKUP_CHUNK_SIZE / BACKUP_MAX_BYTES_PER_SECOND)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, file_name))
+        
+        snapshot = {
+            "id": snapshot_id,
+            "file": file_name,
+            "sha256": hashlib.sha256(payload).hexdigest(),
+            "full": changes["full"],
+            "size": len(payload),
+            "records": sum(len(records) for records in changes["records"].values()),
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M")
+        }
+        snapshots.append(snapshot)
+        self._save_manifest(manifest)
+        return snapshot
+    
+    async def backup(self, db):
+        async with self.lock:
+            snapshots = self.load_manifest()["snapshots"]
+            since_full = 0
+            for snapshot in reversed(snapshots):
+                if snapshot["full"]:
+                    break
+                since_full += 1
+            full = self.force_full or not snapshots or since_full >= BACKUP_FULL_EVERY
+            if not full and not db.has_changes():
+                return None
+            
+            # Copy changed records on the loop in slices, compress and write them off it
+            changes = await db.export_changes(full=full)
+            try:
+                snapshot = await asyncio.to_thread(self._write_snapshot, changes)
+            except Exception:
+                # The exported changes are gone from the dirty set, so start a new chain
+                self.force_full = True
+                raise
+            self.force_full = False
+            return snapshot
+    
+    def _read_chain(self, snapshot_id):
+        snapshots = self.load_manifest()["snapshots"]
+        chain = []
+        for snapshot in snapshots:
+            if snapshot["id"] > snapshot_id:
+                break
+            if snapshot["full"]:
+                chain = []
+            chain.append(snapshot)
+        if not chain or chain[-1]["id"] != snapshot_id:
+            raise ValueError(f"Snapshot {snapshot_id} not found")
+        
+        state = None
+        for snapshot in chain:
+            with open(os.path.join(self.directory, snapshot["file"]), "rb") as f:
+                payload = f.read()
+            if hashlib.sha256(payload).hexdigest() != snapshot["sha256"]:
+                raise ValueError(f"Snapshot {snapshot['id']} failed its checksum")
+            changes = json.loads(gzip.decompress(payload).decode("utf-8"))
+            
+            if state is None:
+                state = changes
+                continue
+            for collection, records in changes["records"].items():
+                state["records"].setdefault(collection, {}).update(records)
+            for log, entries in changes["logs"].items():
+                state["logs"][log].extend(entries)
+            state["meta"] = changes["meta"]
+        return state
+    
+    async def restore(self, db, snapshot_id):
+        async with self.lock:
+            state = await asyncio.to_thread(self._read_chain, snapshot_id)
+            db.load_state(state)
+            self.force_full = True
+            return True
+
+# ==================== CONTENT RELOAD ====================
+class ContentWatcher:
+    """Polls CONTENT_DIR and reloads only the files that changed"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.schedule_path = os.path.join(directory, "schedule.json")
+        self.file_states = {}  # path -> (mtime_ns, size)
+        self.file_keys = {}    # path -> subject / class it defined
+    
+    def scan(self):
+        """Return (changed, removed) paths; only stats files, never reads them"""
+        current = {}
+        for section in ("quiz_questions", "study_materials"):
+            section_dir = os.path.join(self.directory, section)
+            if not os.path.isdir(section_dir):
+                continue
+            for entry in os.scandir(section_dir):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    current[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        if os.path.isfile(self.schedule_path):
+            stat = os.stat(self.schedule_path)
+            current[self.schedule_path] = (stat.st_mtime_ns, stat.st_size)
+        
+        changed = sorted(path for path, state in current.items() if self.file_states.get(path) != state)
+        removed = [path for path in self.file_states if path not in current]
+        return changed, removed, current
+    
+    def _section(self, path):
+        if path == self.schedule_path:
+            return "schedule"
+        return os.path.basename(os.path.dirname(path))
+    
+    def build_updates(self, changed):
+        """Parse changed files and pre-tokenize their search entries; runs in a thread"""
+        updates = []
+        for path in changed:
+            section = self._section(path)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                
+                if section == "schedule":
+                    days = data["days"]
+                    for day in days:
+                        if not isinstance(day, dict) or not isinstance(day["day"], str):
+                            raise ValueError(f"schedule day {day!r} needs a \"day\" name")
+                        self._check_strings(day["items"], f"items of {day['day']}")
+                    updates.append(("schedule", path, None, days, None, []))
+                elif section == "quiz_questions":
+                    subject = data["subject"]
+                    questions = data["questions"]
+                    for question in questions:
+                        self._check_strings([question["question"]], "question")
+                        self._check_strings(question["options"], "options")
+                        if question["answer"] not in question["options"]:
+                            raise ValueError(f"answer {question['answer']!r} is not an option")
+                    documents = [question_document(subject, i, question) for i, question in enumerate(questions)]
+                    updates.append(("quiz_questions", path, subject, questions,
+                                    data.get("title", subject.title()), self._prepare(documents)))
+                else:
+                    class_name = data["class"]
+                    materials = data["materials"]
+                    self._check_strings(materials, "materials")
+                    documents = [material_document(class_name, i, material) for i, material in enumerate(materials)]
+                    updates.append(("study_materials", path, class_name, materials, None, self._prepare(documents)))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Keep serving the previous version until the file is fixed
+                logger.error(f"Skipping content file {path}: {e}")
+        return updates
+    
+    @staticmethod
+    def _check_strings(values, what):
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{what} must be a list of strings")
+    
+    @staticmethod
+    def _prepare(documents):
+        return [document + (SearchIndex.term_counts(*document[2:]),) for document in documents]
+    
+    def apply(self, db, updates, removed, file_states):
+        """Swap new content in; synchronous, so handlers never see a half-applied reload"""
+        for section, path, key, value, title, documents in updates:
+            old_key = self.file_keys.get(path)
+            if old_key is not None and old_key != key:
+                self._drop(db, section, old_key)
+            if section == "schedule":
+                db.replace_schedule(value)
+            elif section == "quiz_questions":
+                db.replace_quiz_subject(key, title, value, documents)
+            else:
+                db.replace_materials(key, value, documents)
+            self.file_keys[path] = key
+        
+        for path in removed:
+            if self._section(path) == "schedule":
+                db.replace_schedule([])
+            else:
+                self._drop(db, self._section(path), self.file_keys.get(path))
+            self.file_keys.pop(path, None)
+        
+        # Broken files are remembered too, so they are only retried once edited again
+        self.file_states = file_states
+    
+    @staticmethod
+    def _drop(db, section, key):
+        if key is None:
+            return
+        if section == "quiz_questions":
+            db.replace_quiz_subject(key, None, None, [])
+        else:
+            db.replace_materials(key, None, [])
+    
+    def load(self, db):
+        """Initial synchronous load at startup"""
+        changed, removed, file_states = self.scan()
+        self.apply(db, self.build_updates(changed), removed, file_states)
+    
+    async def reload(self, db):
+        changed, removed, file_states = await asyncio.to_thread(self.scan)
+        if not changed and not removed:
+            return 0
+        updates = await asyncio.to_thread(self.build_updates, changed)
+        self.apply(db, updates, removed, file_states)
+        return len(updates) + len(removed)
+
+def tenant_content_dir(tenant_id):
+    tenant_dir = os.path.join(CONTENT_DIR, tenant_id)
+    return tenant_dir if os.path.isdir(tenant_dir) else CONTENT_DIR
+
+# ==================== TENANTS ====================
+class Tenant:
+    """One Sunday school: its own data, search index and update budget"""
+    
+    def __init__(self, tenant_id, rate_per_second=TENANT_RATE_PER_SECOND, burst=TENANT_BURST):
+        self.tenant_id = tenant_id
+        self.db = SimpleDB()
+        self.language_manager = LanguageManager()
+        self.backups = BackupManager(os.path.join(BACKUP_DIR, tenant_id))
+        self.content = ContentWatcher(tenant_content_dir(tenant_id))
+        self.content.load(self.db)
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.queue_lock = asyncio.Lock()  # FIFO, so deferred updates keep their order
+        self.running = asyncio.Semaphore(TENANT_CONCURRENCY)
+        self.waiting = 0  # admitted updates not yet running, whatever they wait for
+        self.dropped = 0
+    
+    def allow_update(self):
+        """Token bucket, so a busy parish cannot starve the others"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate_per_second)
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+    
+    def admit(self):
+        """Count an arriving update as waiting; False when too many already are"""
+        if self.waiting >= TENANT_MAX_WAITING:
+            self.dropped += 1
+            return False
+        self.waiting += 1
+        return True
+    
+    async def wait_for_token(self):
+        async with self.queue_lock:
+            while not self.allow_update():
+                await asyncio.sleep((1 - self.tokens) / self.rate_per_second)
+
+class TenantRegistry:
+    """Maps chats to tenants; the map lives in the default tenant's DB so it is backed up"""
+    
+    def __init__(self, tenant_ids, default_tenant, join_codes=None):
+        self.tenants = {tenant_id: Tenant(tenant_id) for tenant_id in tenant_ids}
+        self.default = self.tenants[default_tenant]
+        self.join_codes = join_codes or {}
+    
+    def get(self, tenant_id):
+        return self.tenants.get(tenant_id)
+    
+    def resolve(self, chat_id):
+        if chat_id is None:
+            return self.default
+        return self.tenants.get(self.default.db.get_chat_tenant(chat_id), self.default)
+    
+    def join(self, chat_id, payload):
+        """Move a chat via a deep link: "<tenant>", or "<tenant>-<code>" if the tenant has a join code.
+        
+        Tenants without a code are open on purpose: joining only selects which school's
+        login is shown, and every account still needs that school's own password.
+        """
+        tenant_id, code = payload, None
+        if tenant_id not in self.tenants:
+            tenant_id, _, code = payload.rpartition("-")
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None or self.join_codes.get(tenant_id) != code:
+            return None
+        self.default.db.set_chat_tenant(chat_id, tenant_id)
+        return tenant
+
+tenants = TenantRegistry(TENANT_IDS, DEFAULT_TENANT, TENANT_JOIN_CODES)
+_current_tenant = contextvars.ContextVar("current_tenant", default=None)
+# Set before throttling, so traffic captures keep the original arrival pattern
+_update_arrival = contextvars.ContextVar("update_arrival", default=None)
+
+def current_tenant():
+    return _current_tenant.get() or tenants.default
+
+def use_tenant(tenant):
+    _current_tenant.set(tenant)
+
+class TenantProxy:
+    """Forwards attribute access to the current tenant's instance"""
+    
+    def __init__(self, attribute):
+        self._attribute = attribute
+    
+    def __getattr__(self, name):
+        return getattr(getattr(current_tenant(), self._attribute), name)
+
+db = TenantProxy("db")
+language_manager = TenantProxy("language_manager")
 
-db = SimpleDB()
+async def resolve_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pick the tenant for this update before any other handler runs"""
+    chat = update.effective_chat
+    use_tenant(tenants.resolve(chat.id if chat else None))
+
+class TenantUpdateProcessor(BaseUpdateProcessor):
+    """Runs tenants side by side; each chat's updates still run one at a time, in order.
+    
+    A tenant over its budget has its updates wait for tokens instead of losing them.
+    Limits are per tenant: PTB's shared semaphore is sized so that it never fills up,
+    since each tenant holds at most TENANT_MAX_WAITING + TENANT_CONCURRENCY slots.
+    """
+    
+    def __init__(self, registry):
+        super().__init__(len(registry.tenants) * (TENANT_MAX_WAITING + TENANT_CONCURRENCY))
+        self.registry = registry
+        self.chat_locks = {}  # chat id -> [lock, updates holding or waiting for it]
+        self.busy_replies = set()
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_process_update(self, update, coroutine):
+        _update_arrival.set(time.monotonic())
+        chat = update.effective_chat if isinstance(update, Update) else None
+        chat_id = chat.id if chat else None
+        tenant = self.registry.resolve(chat_id)
+        if not tenant.admit():
+            # Returns without awaiting, so a turned-away update frees its slot at once
+            coroutine.close()
+            logger.warning(f"Tenant {tenant.tenant_id} over its update budget, turned an update away")
+            task = asyncio.create_task(self.reply_busy(update))
+            self.busy_replies.add(task)
+            task.add_done_callback(self.busy_replies.discard)
+            return
+        
+        entry = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                try:
+                    await tenant.wait_for_token()
+                    await tenant.running.acquire()
+                finally:
+                    tenant.waiting -= 1
+                try:
+                    await coroutine
+                finally:
+                    tenant.running.release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[chat_id]
+    
+    @staticmethod
+    async def reply_busy(update):
+        """Tell the user, so a typed password or ID is re-sent rather than silently lost"""
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Busy, please try again")
+            elif update.effective_message:
+                await update.effective_message.reply_text("⏳ Busy, please send that again in a moment.")
+        except TelegramError as e:
+            logger.debug(f"Busy reply failed: {e}")
 # ==================== START COMMAND ====================
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     context.user_data.clear()
     
+    # Deep links (t.me/<bot>?start=<tenant>[-<join code>]) move this chat to another school
+    if context.args:
+        tenant = tenants.join(update.effective_chat.id, context.args[0])
+        if tenant:
+            use_tenant(tenant)
+    
     keyboard = [
         [InlineKeyboardButton("English 🇺🇸", callback_data="lang_en")],
         [InlineKeyboardButton("አማርኛ 🇪🇹", callback_data="lang_am")],
@@ -211,10 +1173,11 @@ async def handle_language_selection(update: Update, context: ContextTypes.DEFAUL
     await query.edit_message_text(
         f"✅ Language set to {language_manager.languages[lang_code]['name']}\n\n"
         "👤 **Please enter your User ID:**\n\n"
-        "📝 **Examples:** STS0001, TCH1001, ADM5001\n\n"
+        "📝 **Examples:** STS0001, TCH1001, ADM5001, PAR2001\n\n"
         "🔑 **Default Passwords:**\n"
         "• Students: student123\n"
         "• Teachers: teacher123\n"
+        "• Parents: parent123\n"
         "• Admins: admin123"
     )
     context.user_data['expecting'] = 'user_id'
@@ -227,7 +1190,7 @@ async def handle_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user_data:
         await update.message.reply_text(
             "❌ **Invalid User ID!**\n\n"
-            "Try: STS0001, TCH1001, ADM5001\n\n"
+            "Try: STS0001, TCH1001, ADM5001, PAR2001\n\n"
             "Enter again:"
         )
         return
@@ -303,7 +1266,8 @@ async def handle_new_password(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     await complete_login(update, context, user_id, user_data)
-    async def complete_login(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, user_data):
+
+async def complete_login(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, user_data):
     """Complete login process"""
     context.user_data['user_id'] = user_id
     context.user_data['user_name'] = user_data['name']
@@ -314,6 +1278,9 @@ async def handle_new_password(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data['student_class'] = user_data['class']
     elif user_data['role'] == 'teacher':
         context.user_data['teacher_subject'] = user_data.get('subject', 'Unknown')
+    elif user_data['role'] == 'parent':
+        # Digests are pushed to the chat the parent last logged in from
+        db.link_chat(user_id, update.effective_chat.id)
     
     context.user_data.pop('login_user_id', None)
     context.user_data.pop('login_user_data', None)
@@ -346,7 +1313,8 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             # Return to menu
             await show_main_menu(update, context, is_callback=False)
-            async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_callback=True):
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_callback=True):
     """Show main menu"""
     user_name = context.user_data.get('user_name', 'User')
     user_role = context.user_data.get('user_role', 'user')
@@ -363,6 +1331,7 @@ Please choose:"""
             [InlineKeyboardButton("📅 Schedule", callback_data="schedule")],
             [InlineKeyboardButton("📊 Grades", callback_data="grades")],
             [InlineKeyboardButton("🎯 Take Quiz", callback_data="take_quiz")],
+            [InlineKeyboardButton("📤 Submit HW", callback_data="submit_hw")],
             [InlineKeyboardButton("⚙️ Settings", callback_data="settings")],
             [InlineKeyboardButton("🚪 Logout", callback_data="logout")]
         ]
@@ -378,11 +1347,27 @@ Please choose:"""
             [InlineKeyboardButton("👨‍🎓 My Students", callback_data="my_students")],
             [InlineKeyboardButton("📝 Assign HW", callback_data="assign_hw")],
             [InlineKeyboardButton("📊 Take Attendance", callback_data="take_attendance")],
+            [InlineKeyboardButton("🎓 Enter Grades", callback_data="enter_grades")],
+            [InlineKeyboardButton("📥 Review Submissions", callback_data="review_0")],
+            [InlineKeyboardButton("📄 Reports", callback_data="reports")],
             [InlineKeyboardButton("📞 Share Contact", callback_data="share_contact")],
             [InlineKeyboardButton("⚙️ Settings", callback_data="settings")],
             [InlineKeyboardButton("🚪 Logout", callback_data="logout")]
         ]
         
+    elif user_role == "parent":
+        welcome_text = f"""👨‍👩‍👧 **Welcome {user_name}!**
+👪 **Parent**
+
+Please choose:"""
+        
+        keyboard = [
+            [InlineKeyboardButton("👨‍👩‍👧 My Children", callback_data="my_children")],
+            [InlineKeyboardButton("📬 Digest Settings", callback_data="digest_settings")],
+            [InlineKeyboardButton("⚙️ Settings", callback_data="settings")],
+            [InlineKeyboardButton("🚪 Logout", callback_data="logout")]
+        ]
+        
     else:  # admin
         welcome_text = f"""👨‍💼 **Welcome {user_name}!**
 🏢 **Administrator**
@@ -391,6 +1376,7 @@ Please choose:"""
         
         keyboard = [
             [InlineKeyboardButton("📊 Analytics", callback_data="analytics")],
+            [InlineKeyboardButton("📄 Reports", callback_data="reports")],
             [InlineKeyboardButton("👨‍🎓 Students", callback_data="manage_students")],
             [InlineKeyboardButton("📞 Share Contact", callback_data="share_contact")],
             [InlineKeyboardButton("⚙️ Settings", callback_data="settings")],
@@ -427,17 +1413,14 @@ async def student_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    text = """📅 **Weekly Schedule**
-
-**Sunday:**
-9:00-10:00 - Sunday School
-10:00-11:00 - Worship Service
-
-**Wednesday:**
-5:00-6:00 - Prayer Meeting
-
-**Friday:**
-5:00-6:30 - Choir Practice"""
+    text = "📅 **Weekly Schedule**"
+    if db.schedule:
+        for day in db.schedule:
+            text += f"\n\n**{day['day']}:**"
+            for item in day["items"]:
+                text += f"\n{item}"
+    else:
+        text += "\n\nNo schedule published."
     
     keyboard = [[InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -467,11 +1450,10 @@ async def take_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Choose subject:"""
     
-    keyboard = [
-        [InlineKeyboardButton("📖 Bible", callback_data="quiz_bible")],
-        [InlineKeyboardButton("🧮 Mathematics", callback_data="quiz_math")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]
-    ]
+    keyboard = [[InlineKeyboardButton(db.quiz_titles.get(subject, subject.title()),
+                                      callback_data=f"quiz_{subject}")]
+                for subject in db.quiz_questions]
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -585,6 +1567,416 @@ Select student:"""
         [InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]
     ]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def teacher_enter_grades(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    text = """🎓 **Enter Grades**
+
+Select student:"""
+    
+    keyboard = [[InlineKeyboardButton(f"{student['name']} ({student.get('class', '')})",
+                                      callback_data=f"grade_{student_id}")]
+                for student_id, student in db.get_students()]
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def teacher_choose_grade_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    student_id = query.data[len("grade_"):]
+    student = db.get_user(student_id)
+    if not student or student["role"] != "student":
+        await query.edit_message_text("❌ Student not found.")
+        return
+    
+    grades = student.get("grades", {})
+    current = "\n".join(f"• {subject}: {grade}" for subject, grade in sorted(grades.items())) or "No grades yet."
+    teacher_subject = context.user_data.get('teacher_subject', 'Unknown')
+    context.user_data['grade_student'] = student_id
+    context.user_data['expecting'] = 'grade_entry'
+    await query.edit_message_text(
+        f"🎓 **{student['name']}**\n\n{current}\n\n"
+        f"Send a score from 0 to 100 for {teacher_subject}, "
+        "or a subject and score (e.g. Math 88):"
+    )
+
+async def handle_grade_entry(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    parts = text.rsplit(maxsplit=1)
+    subject = parts[0] if len(parts) == 2 else context.user_data.get('teacher_subject', 'Unknown')
+    try:
+        grade = int(parts[-1])
+    except (ValueError, IndexError):
+        grade = -1
+    if not 0 <= grade <= 100:
+        await update.message.reply_text("❌ Send a score from 0 to 100 (e.g. 88 or Math 88):")
+        return
+    
+    # A typo or the teacher's long subject name must not start a second column in digests and reports
+    known_subject = db.match_grade_subject(subject)
+    if known_subject is None:
+        await update.message.reply_text(
+            f"❌ Unknown subject '{subject}'. Use one of: {', '.join(db.get_grade_subjects())}")
+        return
+    subject = known_subject
+    
+    student_id = context.user_data.pop('grade_student', None)
+    context.user_data.pop('expecting', None)
+    if not db.set_grade(student_id, subject, grade):
+        await update.message.reply_text("❌ Student not found.")
+    else:
+        await update.message.reply_text(f"✅ {subject}: {grade} saved!")
+    await show_main_menu(update, context, is_callback=False)
+
+# Callback data of the attendance/homework buttons above
+ATTENDANCE_STUDENTS = {"att_1": "STS0001", "att_2": "STS0002"}
+HOMEWORK_CLASSES = {"hw_1": "ቀዳማይ", "hw_2": "ካልኣይ"}
+
+# ==================== WORKER POOLS ====================
+_process_pool = None
+
+def get_process_pool():
+    """Shared pool for CPU-heavy work that must stay off the event loop"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS)
+    return _process_pool
+
+def make_thumbnail(source_path, thumbnail_path):
+    """Runs in the process pool"""
+    with Image.open(source_path) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        image.convert("RGB").save(thumbnail_path, "JPEG", quality=80)
+    return thumbnail_path
+
+# ==================== REPORT RENDERING ====================
+# These run in the process pool, so they only take plain data and file paths.
+REPORT_KINDS = {"summary": "Class Summary", "cards": "Report Cards"}
+REPORT_FORMATS = ("csv", "pdf")
+
+def _average(grades):
+    return sum(grades.values()) / len(grades) if grades else 0
+
+def render_report_csv(kind, class_name, subjects, students, path):
+    # utf-8-sig so spreadsheet apps read Ge'ez names correctly
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        if kind == "summary":
+            writer.writerow(["ID", "Name", "Class", *subjects, "Average", "Days Present"])
+            for student in students:
+                writer.writerow([student["id"], student["name"], class_name,
+                                 *[student["grades"].get(subject, "") for subject in subjects],
+                                 f"{_average(student['grades']):.1f}",
+                                 f"{student['days_present']}/{student['days_recorded']}"])
+        else:
+            writer.writerow(["ID", "Name", "Class", "Subject", "Grade"])
+            for student in students:
+                for subject, grade in sorted(student["grades"].items()):
+                    writer.writerow([student["id"], student["name"], class_name, subject, grade])
+                writer.writerow([student["id"], student["name"], class_name, "Average",
+                                 f"{_average(student['grades']):.1f}"])
+
+def render_report_pdf(kind, class_name, subjects, students, path):
+    font = "Helvetica"
+    if REPORT_PDF_FONT:
+        pdfmetrics.registerFont(TTFont("ReportFont", REPORT_PDF_FONT))
+        font = "ReportFont"
+    
+    pdf = pdf_canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    
+    def page_header(title):
+        pdf.setFont(font, 16)
+        pdf.drawString(50, height - 60, title)
+        pdf.setFont(font, 10)
+        pdf.drawString(50, height - 78, f"{DEVELOPER_NAME} - {datetime.now().strftime('%Y-%m-%d')}")
+        return height - 110
+    
+    if kind == "summary":
+        y = page_header(f"Class Summary: {class_name}")
+        columns = ["Name", *subjects, "Avg", "Present"]
+        for student in [None] + students:
+            if y < 60:
+                pdf.showPage()
+                y = page_header(f"Class Summary: {class_name}")
+            if student is None:
+                values = columns
+            else:
+                values = [student["name"], *[str(student["grades"].get(subject, "-")) for subject in subjects],
+                          f"{_average(student['grades']):.0f}",
+                          f"{student['days_present']}/{student['days_recorded']}"]
+            pdf.drawString(50, y, values[0])
+            for i, value in enumerate(values[1:]):
+                pdf.drawString(220 + i * 60, y, value)
+            y -= 18
+    else:
+        for student in students:
+            y = page_header(f"Report Card: {student['name']}")
+            pdf.drawString(50, y, f"ID: {student['id']}    Class: {class_name}")
+            y -= 30
+            for subject, grade in sorted(student["grades"].items()):
+                pdf.drawString(70, y, subject)
+                pdf.drawString(300, y, f"{grade}%")
+                y -= 18
+            y -= 10
+            pdf.drawString(70, y, "Average")
+            pdf.drawString(300, y, f"{_average(student['grades']):.1f}%")
+            y -= 18
+            pdf.drawString(70, y, "Days present")
+            pdf.drawString(300, y, f"{student['days_present']}/{student['days_recorded']}")
+            pdf.showPage()
+    pdf.save()
+
+def render_report(kind, fmt, class_name, subjects, students, path):
+    """Entry point for the process pool; writes to a temp file then renames"""
+    tmp_path = path + ".tmp"
+    if fmt == "csv":
+        render_report_csv(kind, class_name, subjects, students, tmp_path)
+    else:
+        render_report_pdf(kind, class_name, subjects, students, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+# ==================== HOMEWORK SUBMISSIONS ====================
+class SubmissionStore:
+    """Content-addressed files: identical uploads are stored once"""
+    
+    def __init__(self, root):
+        self.root = root
+    
+    def path_for(self, content_hash, suffix=""):
+        return os.path.join(self.root, content_hash[:2], content_hash + suffix)
+    
+    def new_temp_path(self):
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=tmp_dir)
+        os.close(fd)
+        return path
+    
+    def put(self, tmp_path):
+        """Hash a downloaded file in chunks and move it into place; runs in a thread"""
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        
+        path = self.path_for(content_hash)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.move(tmp_path, path)
+        return content_hash, path
+
+class SubmissionIntake:
+    """Bounded queue + fixed worker pool, so a deadline rush cannot exhaust memory"""
+    
+    def __init__(self, store, workers=SUBMISSION_WORKERS, queue_size=SUBMISSION_QUEUE_SIZE):
+        self.store = store
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.known_files = {}  # Telegram file_unique_id -> content hash
+    
+    def submit(self, job):
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    def start(self, application):
+        for _ in range(self.workers):
+            application.create_task(self._worker(application.bot))
+    
+    async def _worker(self, bot):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(bot, job)
+            except Exception as e:
+                logger.error(f"Submission from {job['student_id']} failed: {e}")
+                try:
+                    await bot.send_message(job["chat_id"], "❌ Could not save your submission. Please send it again.")
+                except Exception:
+                    pass
+            finally:
+                self.queue.task_done()
+    
+    async def _process(self, bot, job):
+        content_hash = self.known_files.get(job["file_unique_id"])
+        if content_hash is None:
+            # Each worker holds at most one file in flight
+            tmp_path = self.store.new_temp_path()
+            try:
+                telegram_file = await bot.get_file(job["file_id"])
+                await telegram_file.download_to_drive(tmp_path)
+                content_hash, _ = await asyncio.to_thread(self.store.put, tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.known_files[job["file_unique_id"]] = content_hash
+        
+        thumbnail = None
+        if job["is_image"] and Image is not None:
+            thumbnail = self.store.path_for(content_hash, ".thumb.jpg")
+            if not os.path.exists(thumbnail):
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(get_process_pool(), make_thumbnail,
+                                               self.store.path_for(content_hash), thumbnail)
+                except Exception as e:
+                    logger.warning(f"Thumbnail for {content_hash} failed: {e}")
+                    thumbnail = None
+        
+        use_tenant(job["tenant"])
+        submission, duplicate = db.add_submission(
+            job["homework_id"], job["student_id"], content_hash, job["file_id"],
+            job["kind"], job["file_name"], thumbnail
+        )
+        if duplicate:
+            await bot.send_message(job["chat_id"], f"ℹ️ You already submitted this file (#{submission['id']}).")
+        else:
+            await bot.send_message(job["chat_id"], f"✅ Submission #{submission['id']} saved!")
+
+submission_intake = SubmissionIntake(SubmissionStore(SUBMISSION_DIR))
+
+async def student_submit_hw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    student_class = context.user_data.get('student_class', 'Unknown')
+    homework = db.get_open_homework(student_class)
+    
+    text = "📤 **Submit Homework**\n\n"
+    keyboard = []
+    if homework:
+        text += "Select assignment:"
+        for hw in reversed(homework):
+            keyboard.append([InlineKeyboardButton(f"📝 {hw['subject']} ({hw['date']})",
+                                                  callback_data=f"submit_{hw['id']}")])
+    else:
+        text += "No homework assigned."
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def student_choose_submission(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    homework = db.get_homework(int(query.data.replace("submit_", "")))
+    if not homework or homework["class"] != context.user_data.get('student_class'):
+        await query.edit_message_text("❌ Assignment not found.")
+        return
+    
+    context.user_data['submitting_hw'] = homework["id"]
+    context.user_data['expecting'] = 'hw_submission'
+    await query.edit_message_text(f"📎 Send a photo or document for **{homework['subject']}**:")
+
+async def handle_submission_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Queue an uploaded photo/document; the download happens in the worker pool"""
+    message = update.message
+    if context.user_data.get('expecting') != 'hw_submission':
+        await message.reply_text("ℹ️ To submit homework, choose 📤 Submit HW from the menu first.")
+        return
+    
+    if message.photo:
+        attachment = message.photo[-1]  # largest size
+        kind, file_name, is_image = "photo", "photo.jpg", True
+    else:
+        attachment = message.document
+        kind, file_name = "document", attachment.file_name or "document"
+        is_image = (attachment.mime_type or "").startswith("image/")
+    
+    if attachment.file_size and attachment.file_size > SUBMISSION_MAX_BYTES:
+        await message.reply_text("❌ File is too large (max 20 MB).")
+        return
+    
+    job = {
+        "tenant": current_tenant(),
+        "chat_id": message.chat_id,
+        "student_id": context.user_data.get('user_id'),
+        "homework_id": context.user_data.get('submitting_hw'),
+        "file_id": attachment.file_id,
+        "file_unique_id": attachment.file_unique_id,
+        "kind": kind,
+        "file_name": file_name,
+        "is_image": is_image
+    }
+    if not submission_intake.submit(job):
+        await message.reply_text("⏳ Many submissions right now. Please send it again in a minute.")
+        return
+    
+    context.user_data.pop('expecting', None)
+    context.user_data.pop('submitting_hw', None)
+    await message.reply_text("📥 Received! Saving your submission...")
+
+async def teacher_review_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    page = int(query.data.replace("review_", "") or 0)
+    items, total = db.get_review_queue(context.user_data.get('user_id'), page, REVIEW_PAGE_SIZE)
+    
+    text = f"📥 **Submissions to Review** ({total})\n\n"
+    keyboard = []
+    if items:
+        for submission in items:
+            student = db.get_user(submission["student_id"]) or {}
+            homework = db.get_homework(submission["homework_id"]) or {}
+            label = f"{student.get('name', submission['student_id'])} - {homework.get('subject', '?')}"
+            keyboard.append([InlineKeyboardButton(f"📄 {label}", callback_data=f"sub_{submission['id']}")])
+    else:
+        text += "Nothing to review."
+    
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"review_{page - 1}"))
+    if (page + 1) * REVIEW_PAGE_SIZE < total:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"review_{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def teacher_open_submission(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    submission = db.get_teacher_submission(query.data.replace("sub_", ""), context.user_data.get('user_id'))
+    if not submission:
+        await query.edit_message_text("❌ Submission not found.")
+        return
+    
+    student = db.get_user(submission["student_id"]) or {}
+    caption = f"📄 {student.get('name', submission['student_id'])} - {submission['date']}"
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✔️ Mark Reviewed", callback_data=f"reviewed_{submission['id']}")],
+        [InlineKeyboardButton("⬅️ Back", callback_data="review_0")]
+    ])
+    # Re-send by Telegram file_id: no upload, and nothing read from disk
+    if submission["kind"] == "photo":
+        await context.bot.send_photo(query.message.chat_id, submission["file_id"],
+                                     caption=caption, reply_markup=keyboard)
+    else:
+        await context.bot.send_document(query.message.chat_id, submission["file_id"],
+                                        caption=caption, reply_markup=keyboard)
+
+async def teacher_mark_reviewed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    submission = db.get_teacher_submission(query.data.replace("reviewed_", ""), context.user_data.get('user_id'))
+    if not submission:
+        await query.edit_message_text("❌ Submission not found.")
+        return
+    
+    db.mark_reviewed(submission["id"])
+    keyboard = [[InlineKeyboardButton("📥 Next Submission", callback_data="review_0")]]
+    await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
     # ==================== ADMIN FEATURES ====================
 async def admin_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -598,9 +1990,449 @@ async def admin_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 **Status:** ✅ Operational"""
     
+    if profiler.active:
+        text += "\n🔬 **Profiling:** running"
+    
+    keyboard = [
+        [InlineKeyboardButton(f"🔬 Profile {PROFILE_DEFAULT_SECONDS}s", callback_data="profile_start")],
+        [InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def admin_backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /backup, /backups and /restore <id> commands"""
+    if context.user_data.get('user_role') != 'admin':
+        await update.message.reply_text("❌ Admins only.")
+        return
+    
+    backups = current_tenant().backups
+    command = update.message.text.split()[0].lstrip("/").split("@")[0]
+    
+    if command == "backup":
+        snapshot = await backups.backup(db)
+        if snapshot:
+            await update.message.reply_text(
+                f"✅ Snapshot #{snapshot['id']} saved ({snapshot['records']} records, {snapshot['size']} bytes)"
+            )
+        else:
+            await update.message.reply_text("ℹ️ Nothing changed since the last snapshot.")
+    
+    elif command == "backups":
+        snapshots = backups.load_manifest()["snapshots"][-10:]
+        text = "💾 **Recent Snapshots**\n\n"
+        if snapshots:
+            for snapshot in reversed(snapshots):
+                kind = "full" if snapshot["full"] else "incremental"
+                text += f"#{snapshot['id']} - {snapshot['date']} ({kind}, {snapshot['records']} records)\n"
+            text += "\nRestore with /restore <id>"
+        else:
+            text += "No snapshots yet."
+        await update.message.reply_text(text)
+    
+    else:  # restore
+        if not context.args or not context.args[0].isdigit():
+            await update.message.reply_text("Usage: /restore <snapshot id>")
+            return
+        try:
+            await backups.restore(db, int(context.args[0]))
+        except (ValueError, OSError) as e:
+            await update.message.reply_text(f"❌ Restore failed: {e}")
+            return
+        await update.message.reply_text(f"✅ Restored snapshot #{context.args[0]}")
+
+# ==================== PROFILING ====================
+# Callbacks that carry a value; grouped so the route table stays readable
+DYNAMIC_ROUTE_PREFIXES = ("answer_", "quiz_", "lang_", "att_", "hw_", "submit_", "review_",
+                          "sub_", "reviewed_", "rptc_", "rpt_", "grade_")
+
+def callback_route(data):
+    for prefix in DYNAMIC_ROUTE_PREFIXES:
+        if data.startswith(prefix):
+            return prefix + "*"
+    return data
+
+class ProfilingSession:
+    """cProfile + tracemalloc for a time or update budget; a single flag check when off"""
+    
+    def __init__(self):
+        self.active = False
+        self.profiler = None
+        self.route_times = {}
+        self.updates = 0
+        self.max_updates = None
+        self.chat_id = None
+        self.started_at = 0
+        self.owns_tracemalloc = False
+        self.stop_task = None
+    
+    def start(self, chat_id, max_updates=None):
+        self.route_times = {}
+        self.updates = 0
+        self.max_updates = max_updates
+        self.chat_id = chat_id
+        self.started_at = time.monotonic()
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        self.active = True
+    
+    def record_route(self, route, elapsed):
+        timings = self.route_times.setdefault(route, [])
+        timings.append(elapsed)
+        self.updates += 1
+        return self.max_updates is not None and self.updates >= self.max_updates
+    
+    def stop(self):
+        """Stop collecting and return the report text"""
+        self.active = False
+        self.profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+        
+        lines = [
+            "PROFILE REPORT",
+            f"Duration: {time.monotonic() - self.started_at:.1f}s",
+            f"Callback updates: {self.updates}",
+            "",
+            "==== Slowest routes (handle_callback) ====",
+            f"{'route':<24} {'calls':>6} {'avg ms':>9} {'max ms':>9}",
+        ]
+        routes = sorted(self.route_times.items(), key=lambda item: -max(item[1]))
+        for route, timings in routes:
+            lines.append(f"{route:<24} {len(timings):>6} "
+                         f"{sum(timings) / len(timings) * 1000:>9.2f} {max(timings) * 1000:>9.2f}")
+        
+        lines += ["", "==== Top functions (cumulative) ===="]
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        lines.append(stream.getvalue())
+        
+        lines.append("==== Top allocations ====")
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+            lines.append(str(stat))
+        
+        self.profiler = None
+        return "\n".join(lines)
+
+profiler = ProfilingSession()
+
+async def finish_profiling(bot):
+    if not profiler.active:
+        return
+    if profiler.stop_task and profiler.stop_task is not asyncio.current_task():
+        profiler.stop_task.cancel()
+    profiler.stop_task = None
+    chat_id = profiler.chat_id
+    report = profiler.stop()
+    
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        f.write(report)
+        report_path = f.name
+    try:
+        with open(report_path, "rb") as f:
+            await bot.send_document(
+                chat_id, f, filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
+                caption="🔬 Profiling report"
+            )
+    finally:
+        os.remove(report_path)
+
+async def stop_profiling_after(bot, seconds):
+    await asyncio.sleep(seconds)
+    await finish_profiling(bot)
+
+async def begin_profiling(context: ContextTypes.DEFAULT_TYPE, chat_id, seconds=None, max_updates=None):
+    if profiler.active:
+        return False
+    profiler.start(chat_id, max_updates=max_updates)
+    # Never leave cProfile and tracemalloc running without a stop scheduled
+    profiler.stop_task = context.application.create_task(
+        stop_profiling_after(context.bot, seconds or PROFILE_MAX_SECONDS))
+    return True
+
+async def admin_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /profile [seconds | <n>u | stop]"""
+    if context.user_data.get('user_role') != 'admin':
+        await update.message.reply_text("❌ Admins only.")
+        return
+    
+    arg = context.args[0].lower() if context.args else str(PROFILE_DEFAULT_SECONDS)
+    if arg == "stop":
+        if profiler.active:
+            await finish_profiling(context.bot)
+        else:
+            await update.message.reply_text("ℹ️ Profiling is not running.")
+        return
+    
+    seconds, max_updates = None, None
+    if arg.endswith("u") and arg[:-1].isdigit() and int(arg[:-1]) >= 1:
+        max_updates = int(arg[:-1])
+        # Still bounded in time so a quiet bot does not profile forever
+        seconds = PROFILE_MAX_SECONDS
+    elif arg.isdigit() and int(arg) >= 1:
+        seconds = min(int(arg), PROFILE_MAX_SECONDS)
+    else:
+        await update.message.reply_text("Usage: /profile [seconds | <n>u | stop]")
+        return
+    
+    if not await begin_profiling(context, update.effective_chat.id, seconds, max_updates):
+        await update.message.reply_text("ℹ️ Profiling is already running.")
+        return
+    limit = f"{max_updates} updates" if max_updates else f"{seconds}s"
+    await update.message.reply_text(f"🔬 Profiling started for {limit}. Report will follow.")
+
+# ==================== REPORT EXPORTS ====================
+class ReportCache:
+    """Reuses rendered reports until the class's grades or attendance change"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}    # key -> {"version", "path", "file_id"}
+        self.in_flight = {}  # key -> Task, so identical requests render once
+    
+    async def get_report(self, tenant_id, kind, fmt, class_name):
+        version = db.get_report_version(class_name)
+        key = (tenant_id, kind, fmt, class_name)
+        entry = self.entries.get(key)
+        if entry and entry["version"] == version and os.path.exists(entry["path"]):
+            return entry
+        
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, version, class_name, entry))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _render(self, key, version, class_name, old_entry):
+        tenant_id, kind, fmt, _ = key
+        subjects, students = db.get_class_report_data(class_name)
+        directory = os.path.join(self.directory, tenant_id)
+        os.makedirs(directory, exist_ok=True)
+        class_slug = hashlib.sha1(class_name.encode("utf-8")).hexdigest()[:8]
+        path = os.path.join(directory, f"{kind}_{class_slug}_{version[0]}_{version[1]}.{fmt}")
+        
+        await asyncio.get_running_loop().run_in_executor(
+            get_process_pool(), render_report, kind, fmt, class_name, subjects, students, path
+        )
+        if old_entry and old_entry["path"] != path and os.path.exists(old_entry["path"]):
+            os.remove(old_entry["path"])
+        
+        entry = {"version": version, "path": path, "file_id": None}
+        self.entries[key] = entry
+        return entry
+
+report_cache = ReportCache(REPORT_DIR)
+
+async def send_report(bot, chat_id, tenant, kind, fmt, class_name):
+    """Background job: render (or reuse) the report and send it as a document"""
+    use_tenant(tenant)
+    try:
+        entry = await report_cache.get_report(tenant.tenant_id, kind, fmt, class_name)
+        filename = f"{REPORT_KINDS[kind].replace(' ', '_')}_{class_name}.{fmt}"
+        if entry["file_id"]:
+            await bot.send_document(chat_id, entry["file_id"], caption=f"📄 {REPORT_KINDS[kind]}: {class_name}")
+            return
+        with open(entry["path"], "rb") as f:
+            message = await bot.send_document(chat_id, f, filename=filename,
+                                              caption=f"📄 {REPORT_KINDS[kind]}: {class_name}")
+        entry["file_id"] = message.document.file_id if message.document else None
+    except Exception as e:
+        logger.error(f"Report {kind}/{fmt} for {class_name} failed: {e}")
+        await bot.send_message(chat_id, "❌ Could not build the report. Please try again.")
+
+async def show_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    classes = db.get_classes()
+    text = "📄 **Reports**\n\nSelect class:"
+    keyboard = [[InlineKeyboardButton(f"🏫 {class_name}", callback_data=f"rptc_{i}")]
+                for i, class_name in enumerate(classes)]
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def show_report_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    index = query.data.replace("rptc_", "")
+    classes = db.get_classes()
+    if not index.isdigit() or int(index) >= len(classes):
+        await query.edit_message_text("❌ Class not found.")
+        return
+    
+    formats = [fmt for fmt in REPORT_FORMATS if fmt != "pdf" or pdf_canvas is not None]
+    keyboard = []
+    for kind, label in REPORT_KINDS.items():
+        keyboard.append([InlineKeyboardButton(f"{label} ({fmt.upper()})", callback_data=f"rpt_{kind}_{fmt}_{index}")
+                         for fmt in formats])
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="reports")])
+    await query.edit_message_text(f"📄 **Reports for {classes[int(index)]}**\n\nChoose report:",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def request_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    parts = query.data.split("_")
+    classes = db.get_classes()
+    if (len(parts) != 4 or parts[1] not in REPORT_KINDS or parts[2] not in REPORT_FORMATS
+            or not parts[3].isdigit() or int(parts[3]) >= len(classes)):
+        await query.edit_message_text("❌ Unknown report.")
+        return
+    if parts[2] == "pdf" and pdf_canvas is None:
+        await query.edit_message_text("❌ PDF export is not available on this server.")
+        return
+    
+    _, kind, fmt, index = parts
+    class_name = classes[int(index)]
+    context.application.create_task(
+        send_report(context.bot, query.message.chat_id, current_tenant(), kind, fmt, class_name)
+    )
+    keyboard = [[InlineKeyboardButton("⬅️ Menu", callback_data="main_menu")]]
+    await query.edit_message_text(f"⏳ Preparing {REPORT_KINDS[kind]} for {class_name}...",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+
+# ==================== PARENT FEATURES ====================
+async def parent_children(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    children = db.get_children(context.user_data.get('user_id'))
+    text = "👨‍👩‍👧 **My Children**\n\n"
+    if children:
+        for i, (child_id, child) in enumerate(children, 1):
+            grades = child.get("grades", {})
+            average = sum(grades.values()) / len(grades) if grades else 0
+            text += f"{i}. **{child['name']}** ({child_id})\n"
+            text += f"   - Class: {child.get('class', 'Unknown')}\n"
+            text += f"   - Average: {average:.0f}%\n"
+    else:
+        text += "No children linked to your account."
+    
     keyboard = [[InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+async def parent_digest_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = context.user_data.get('user_id')
+    if query.data in ("digest_daily", "digest_weekly"):
+        db.set_digest_frequency(user_id, query.data.replace("digest_", ""))
+    
+    parent = db.get_user(user_id) or {}
+    frequency = parent.get("digest", "daily")
+    text = f"""📬 **Digest Settings**
+
+Current: **{frequency.title()}**
+Digests are sent at {DIGEST_HOUR}:00."""
+    
+    keyboard = [
+        [InlineKeyboardButton(f"{'✅ ' if frequency == 'daily' else ''}Daily", callback_data="digest_daily")],
+        [InlineKeyboardButton(f"{'✅ ' if frequency == 'weekly' else ''}Weekly", callback_data="digest_weekly")],
+        [InlineKeyboardButton("⬅️ Back", callback_data="main_menu")]
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+# ==================== DIGEST DELIVERY ====================
+DIGEST_TEXTS = {
+    "en": {"daily": "📬 Daily report", "weekly": "📬 Weekly report",
+           "grade": "📊 {subject}: {grade}%", "present": "✅ Present", "absent": "❌ Absent",
+           "homework": "📝 New homework: {subject}"},
+    "am": {"daily": "📬 ዕለታዊ ሪፖርት", "weekly": "📬 ሳምንታዊ ሪፖርት",
+           "grade": "📊 {subject}: {grade}%", "present": "✅ ተገኝቷል", "absent": "❌ አልተገኘም",
+           "homework": "📝 አዲስ የቤት ስራ: {subject}"},
+    "or": {"daily": "📬 Gabaasa guyyaa", "weekly": "📬 Gabaasa torbanii",
+           "grade": "📊 {subject}: {grade}%", "present": "✅ Argameera", "absent": "❌ Hin argamne",
+           "homework": "📝 Hojii manaa haaraa: {subject}"},
+}
+
+def render_digest(children_events, lang_code, frequency):
+    texts = DIGEST_TEXTS.get(lang_code, DIGEST_TEXTS["en"])
+    lines = [f"**{texts[frequency]}**", ""]
+    
+    for child_id, events in children_events.items():
+        child = db.get_user(child_id)
+        lines.append(f"👤 **{child['name'] if child else child_id}**")
+        for event in events:
+            if event["type"] == "grade":
+                line = texts["grade"].format(**event["detail"])
+            elif event["type"] == "attendance":
+                line = texts["present"] if event["detail"]["present"] else texts["absent"]
+            else:
+                line = texts["homework"].format(**event["detail"])
+            lines.append(f"{event['date']} {line}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+class DigestQueue:
+    """Paces digest messages so a batch is spread over the delivery window"""
+    
+    def __init__(self, window_seconds=DIGEST_WINDOW_SECONDS, max_per_second=DIGEST_MAX_PER_SECOND):
+        self.window_seconds = window_seconds
+        self.max_per_second = max_per_second
+        self.queue = asyncio.Queue()
+        self.interval = 1 / max_per_second
+    
+    def enqueue_batch(self, messages):
+        if not messages:
+            return
+        pending = self.queue.qsize() + len(messages)
+        self.interval = max(self.window_seconds / pending, 1 / self.max_per_second)
+        for chat_id, text in messages:
+            self.queue.put_nowait((chat_id, text))
+    
+    async def run(self, bot):
+        while True:
+            chat_id, text = await self.queue.get()
+            try:
+                await bot.send_message(chat_id, text)
+            except Exception as e:
+                logger.warning(f"Digest to {chat_id} failed: {e}")
+            finally:
+                self.queue.task_done()
+            await asyncio.sleep(self.interval)
+
+digest_queue = DigestQueue()
+
+def seconds_until_hour(hour):
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+def build_digest_batch():
+    include_weekly = datetime.now().weekday() == DIGEST_WEEKLY_DAY
+    messages = []
+    for parent_id, parent, children_events in db.collect_digests(include_weekly=include_weekly):
+        chat_id = parent["chat_id"]
+        lang_code = language_manager.get_language(str(chat_id))
+        text = render_digest(children_events, lang_code, parent.get("digest", "daily"))
+        messages.append((chat_id, text))
+    return messages
+
+async def digest_scheduler():
+    while True:
+        await asyncio.sleep(seconds_until_hour(DIGEST_HOUR))
+        for tenant in tenants.tenants.values():
+            try:
+                use_tenant(tenant)
+                messages = build_digest_batch()
+                logger.info(f"Queued {len(messages)} parent digests for {tenant.tenant_id}")
+                digest_queue.enqueue_batch(messages)
+            except Exception as e:
+                logger.error(f"Digest batch failed for {tenant.tenant_id}: {e}")
+
 # ==================== CONTACT MANAGEMENT ====================
 async def share_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -687,8 +2519,62 @@ async def change_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text("Enter new password (min 6 chars):")
     context.user_data['expecting'] = 'change_password'
+
+# ==================== SEARCH ====================
+SEARCH_KIND_ICONS = {"user": "👤", "material": "📚", "question": "❓"}
+
+def search_kinds_for_role(user_role):
+    # Students and parents only see content, never other people's accounts
+    if user_role in ("student", "parent"):
+        return {"material", "question"}
+    return None
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /search command"""
+    if not context.user_data.get('logged_in'):
+        await update.message.reply_text("❌ Please login with /start")
+        return
+    
+    if not context.args:
+        context.user_data['expecting'] = 'search_query'
+        await update.message.reply_text("🔍 Enter a name, material or question to search:")
+        return
+    
+    await send_search_results(update, context, " ".join(context.args))
+
+async def send_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, search_query):
+    kinds = search_kinds_for_role(context.user_data.get('user_role'))
+    results = db.search(search_query, kinds=kinds)
+    
+    text = f"🔍 **Results for \"{search_query}\"**\n\n"
+    if results:
+        for i, result in enumerate(results, 1):
+            icon = SEARCH_KIND_ICONS.get(result["kind"], "•")
+            text += f"{i}. {icon} {result['title']}"
+            if result["detail"]:
+                text += f" ({result['detail']})"
+            text += "\n"
+    else:
+        text += "No matches found."
+    
+    context.user_data.pop('expecting', None)
+    keyboard = [[InlineKeyboardButton("⬅️ Menu", callback_data="main_menu")]]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
     # ==================== CALLBACK HANDLER ====================
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not profiler.active:
+        await route_callback(update, context)
+        return
+    
+    started = time.perf_counter()
+    try:
+        await route_callback(update, context)
+    finally:
+        if profiler.active and profiler.record_route(callback_route(update.callback_query.data),
+                                                      time.perf_counter() - started):
+            context.application.create_task(finish_profiling(context.bot))
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
@@ -698,13 +2584,25 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "materials", "schedule", "grades", "take_quiz", "my_students",
         "assign_hw", "take_attendance", "analytics", "manage_students",
         "share_contact", "view_contacts", "settings", "change_lang",
-        "change_pass"
+        "change_pass", "my_children", "digest_settings", "digest_daily",
+        "digest_weekly", "profile_start", "submit_hw", "reports", "enter_grades"
     ]
+    # Routes that carry an id are checked by role as well as login
+    role_prefixes = {
+        "submit_": ("student",), "review_": ("teacher",), "sub_": ("teacher",),
+        "reviewed_": ("teacher",), "enter_grades": ("teacher",), "grade_": ("teacher",),
+        "reports": ("teacher", "admin"), "rpt": ("teacher", "admin")
+    }
     
     if data in protected_routes and not context.user_data.get('logged_in'):
         await query.edit_message_text("❌ Please login with /start")
         return
     
+    for prefix, roles in role_prefixes.items():
+        if data.startswith(prefix) and context.user_data.get('user_role') not in roles:
+            await query.edit_message_text("❌ Please login with /start")
+            return
+    
     # Route handling
     if data == "main_menu":
         await show_main_menu(update, context, is_callback=True)
@@ -734,6 +2632,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await student_grades(update, context)
     elif data == "take_quiz":
         await take_quiz(update, context)
+    elif data == "submit_hw":
+        await student_submit_hw(update, context)
+    elif data.startswith("submit_"):
+        await student_choose_submission(update, context)
     
     # Teacher features
     elif data == "my_students":
@@ -742,10 +2644,41 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await teacher_assign_hw(update, context)
     elif data == "take_attendance":
         await teacher_take_attendance(update, context)
+    elif data.startswith("review_"):
+        await teacher_review_queue(update, context)
+    elif data.startswith("sub_"):
+        await teacher_open_submission(update, context)
+    elif data.startswith("reviewed_"):
+        await teacher_mark_reviewed(update, context)
+    elif data == "enter_grades":
+        await teacher_enter_grades(update, context)
+    elif data.startswith("grade_"):
+        await teacher_choose_grade_student(update, context)
+    
+    # Reports (teachers and admins)
+    elif data == "reports":
+        await show_reports(update, context)
+    elif data.startswith("rptc_"):
+        await show_report_options(update, context)
+    elif data.startswith("rpt_"):
+        await request_report(update, context)
+    
+    # Parent features
+    elif data == "my_children":
+        await parent_children(update, context)
+    elif data in ["digest_settings", "digest_daily", "digest_weekly"]:
+        await parent_digest_settings(update, context)
     
     # Admin features
     elif data == "analytics":
         await admin_analytics(update, context)
+    elif data == "profile_start":
+        if context.user_data.get('user_role') != 'admin':
+            await query.edit_message_text("❌ Admins only.")
+        elif await begin_profiling(context, query.message.chat_id, seconds=PROFILE_DEFAULT_SECONDS):
+            await query.edit_message_text(f"🔬 Profiling started for {PROFILE_DEFAULT_SECONDS}s. Report will follow.")
+        else:
+            await query.edit_message_text("ℹ️ Profiling is already running.")
     elif data == "manage_students":
         await query.edit_message_text("✅ Student management")
         await show_main_menu(update, context, is_callback=True)
@@ -769,6 +2702,13 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # Handle attendance or other dynamic callbacks
         if data.startswith("att_") or data.startswith("hw_"):
+            is_teacher = context.user_data.get('user_role') == 'teacher'
+            if is_teacher and data in ATTENDANCE_STUDENTS:
+                db.record_attendance(ATTENDANCE_STUDENTS[data])
+            elif is_teacher and data in HOMEWORK_CLASSES:
+                db.assign_homework(HOMEWORK_CLASSES[data],
+                                   context.user_data.get('teacher_subject', 'Unknown'),
+                                   context.user_data.get('user_id'))
             await query.edit_message_text("✅ Action completed!")
             await show_main_menu(update, context, is_callback=True)
         else:
@@ -806,6 +2746,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('expecting', None)
         await show_main_menu(update, context, is_callback=False)
     
+    elif expecting == 'search_query':
+        await send_search_results(update, context, text)
+    
+    elif expecting == 'grade_entry' and context.user_data.get('user_role') == 'teacher':
+        await handle_grade_entry(update, context, text)
+    
     elif expecting == 'manual_contact':
         user_id = context.user_data.get('user_id')
         contact_info = {"phone": text, "name": context.user_data.get('user_name')}
@@ -826,7 +2772,190 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
+# ==================== TRAFFIC CAPTURE ====================
+# Typed text in these states is a secret, or names people, and never written to the log
+SENSITIVE_STATES = {"password", "new_password", "change_password", "manual_contact", "search_query"}
+REDACTED_TEXT = "******"
+# School IDs keep their role prefix, so replay.py can log in as a seeded user of the same role
+SCHOOL_ID_PATTERN = re.compile(r"(?<![A-Z0-9])([A-Z]{3})\d{4}(?![0-9])")
+PSEUDONYM_PATTERN = re.compile(r"(?<![A-Z0-9])([A-Z]{3})#([0-9A-F]{6})(?![0-9A-F])")
+ANONYMIZED_ID_KEYS = {"from", "chat", "user", "sender_chat", "forward_from"}
+MESSAGE_UPDATE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post")
+ANONYMIZED_NAME_KEYS = {"first_name", "last_name", "username", "title", "phone_number", "vcard"}
+
+class TrafficRecorder:
+    """Appends anonymized updates with their arrival offset to a gzip JSON-lines log"""
+    
+    def __init__(self, path, salt=TRAFFIC_SALT):
+        self.path = path
+        # A fresh salt per run unless pinned, so logs cannot be joined back to users
+        self.salt = salt or os.urandom(16).hex()
+        self.file = None
+        self.started = None
+        self.pending = 0
+    
+    def _anonymous_id(self, value):
+        digest = hashlib.sha256(f"{self.salt}:{value}".encode()).hexdigest()
+        return int(digest[:12], 16)
+    
+    def _pseudonymize_ids(self, text):
+        """STS0001 -> STS#<salted hash>, the same pseudonym every time within a run"""
+        return SCHOOL_ID_PATTERN.sub(
+            lambda match: f"{match.group(1)}#{self._anonymous_id(match.group(0)) & 0xFFFFFF:06X}", text)
+    
+    def _anonymize(self, data, parent_key=None):
+        if isinstance(data, list):
+            return [self._anonymize(item, parent_key) for item in data]
+        if not isinstance(data, dict):
+            return data
+        
+        result = {}
+        for key, value in data.items():
+            if key == "id" and parent_key in ANONYMIZED_ID_KEYS:
+                result[key] = self._anonymous_id(value)
+            elif key == "user_id":
+                result[key] = self._anonymous_id(value)
+            elif key in ("file_id", "file_unique_id"):
+                result[key] = f"anon_{self._anonymous_id(value)}"
+            elif key in ANONYMIZED_NAME_KEYS:
+                result[key] = "anon"
+            else:
+                result[key] = self._anonymize(value, key)
+        return result
+    
+    def record(self, update, expecting=None, arrived=None):
+        arrived = arrived or time.monotonic()
+        if self.file is None:
+            self.file = gzip.open(self.path, "at", encoding="utf-8")
+            self.started = arrived
+        
+        data = self._anonymize(update.to_dict())
+        for key in MESSAGE_UPDATE_KEYS:
+            if key in data:
+                self._redact_message(data[key], expecting)
+        if "callback_query" in data and "data" in data["callback_query"]:
+            data["callback_query"]["data"] = self._pseudonymize_ids(data["callback_query"]["data"])
+        if "callback_query" in data and "message" in data["callback_query"]:
+            # The bot's own message under the buttons can show names and grades
+            message = data["callback_query"]["message"]
+            data["callback_query"]["message"] = {key: message[key] for key in ("message_id", "date", "chat")
+                                                 if key in message}
+        
+        # Handling order can differ from arrival order; replay.py sorts by t
+        self.file.write(json.dumps({"t": round(max(0, arrived - self.started), 4), "update": data},
+                                   ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= TRAFFIC_FLUSH_EVERY:
+            self.file.flush()
+            self.pending = 0
+    
+    def _redact_message(self, message, expecting):
+        """Same rules for new and edited messages, whichever state the chat is in"""
+        # The bot never reads captions, and homework captions often name students
+        if "caption" in message:
+            message["caption"] = REDACTED_TEXT
+        if "reply_to_message" in message:
+            # Usually one of the bot's own messages, which can show names and grades
+            message["reply_to_message"] = {key: message["reply_to_message"][key]
+                                           for key in ("message_id", "date", "chat")
+                                           if key in message["reply_to_message"]}
+        if "text" not in message:
+            return
+        
+        text = message["text"]
+        if expecting in SENSITIVE_STATES:
+            message["text"] = REDACTED_TEXT
+        elif expecting == "user_id":
+            text = text.upper().strip()
+            message["text"] = self._pseudonymize_ids(text) if SCHOOL_ID_PATTERN.fullmatch(text) else REDACTED_TEXT
+        elif text.startswith("/search") and len(text.split(maxsplit=1)) > 1:
+            message["text"] = f"{text.split()[0]} {REDACTED_TEXT}"
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG) if TRAFFIC_LOG else None
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        expecting = context.user_data.get('expecting') if context.user_data is not None else None
+        traffic_recorder.record(update, expecting, _update_arrival.get())
+    except Exception as e:
+        logger.warning(f"Traffic capture failed: {e}")
+
 # ==================== MAIN FUNCTION ====================
+async def content_watcher():
+    while True:
+        await asyncio.sleep(CONTENT_POLL_SECONDS)
+        for tenant in tenants.tenants.values():
+            try:
+                started = time.perf_counter()
+                reloaded = await tenant.content.reload(tenant.db)
+                if reloaded:
+                    logger.info(f"Reloaded {reloaded} content file(s) for {tenant.tenant_id} "
+                                f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+            except Exception as e:
+                logger.error(f"Content reload failed for {tenant.tenant_id}: {e}")
+
+async def backup_scheduler():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_SECONDS)
+        for tenant in tenants.tenants.values():
+            try:
+                snapshot = await tenant.backups.backup(tenant.db)
+                if snapshot:
+                    logger.info(f"Backup #{snapshot['id']} written for {tenant.tenant_id}")
+            except Exception as e:
+                logger.error(f"Backup failed for {tenant.tenant_id}: {e}")
+
+async def restore_latest_backups():
+    for tenant in tenants.tenants.values():
+        snapshots = tenant.backups.load_manifest()["snapshots"]
+        if snapshots:
+            await tenant.backups.restore(tenant.db, snapshots[-1]["id"])
+            logger.info(f"Restored {tenant.tenant_id} from snapshot #{snapshots[-1]['id']}")
+
+async def stop_background_tasks(application: Application):
+    if traffic_recorder:
+        traffic_recorder.close()
+
+async def start_background_tasks(application: Application):
+    await restore_latest_backups()
+    submission_intake.start(application)
+    application.create_task(content_watcher())
+    application.create_task(backup_scheduler())
+    application.create_task(digest_queue.run(application.bot))
+    application.create_task(digest_scheduler())
+
+def build_application(token, request=None, throttle=True):
+    """Wire up all handlers; replay.py passes a stub request and throttle=False to run without Telegram"""
+    builder = Application.builder().token(token)
+    if throttle:
+        builder = builder.concurrent_updates(TenantUpdateProcessor(tenants))
+    if request is not None:
+        builder = builder.request(request)
+    else:
+        builder = builder.post_init(start_background_tasks).post_shutdown(stop_background_tasks)
+    app = builder.build()
+    
+    # Add handlers
+    if traffic_recorder:
+        app.add_handler(TypeHandler(Update, record_update), group=-2)
+    app.add_handler(TypeHandler(Update, resolve_tenant), group=-1)
+    app.add_handler(CommandHandler("start", start_command))
+    app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CommandHandler(["backup", "backups", "restore"], admin_backup_command))
+    app.add_handler(CommandHandler("profile", admin_profile_command))
+    app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.CONTACT, handle_contact))
+    app.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, handle_submission_upload))
+    
+    app.add_error_handler(error_handler)
+    return app
+
 def main():
     if not BOT_TOKEN:
         print("❌ Set TELEGRAM_BOT_TOKEN environment variable!")
@@ -834,15 +2963,7 @@ def main():
         return
     
     try:
-        app = Application.builder().token(BOT_TOKEN).build()
-        
-        # Add handlers
-        app.add_handler(CommandHandler("start", start_command))
-        app.add_handler(CallbackQueryHandler(handle_callback))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        app.add_handler(MessageHandler(filters.CONTACT, handle_contact))
-        
-        app.add_error_handler(error_handler)
+        app = build_application(BOT_TOKEN)
         
         print("=" * 50)
         print("✅ Sunday School Bot Started!")
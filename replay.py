@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+TRAFFIC REPLAY FOR PERFORMANCE REGRESSION CHECKS
+Feeds a log written with TRAFFIC_LOG into the bot's handlers against a stubbed
+Bot API and compares per-route latency between two versions of Debreselam.py.
+Tenant throttling is switched off so every update reaches its handler.
+
+Usage:
+    python replay.py traffic.jsonl.gz                       # replay current version
+    python replay.py traffic.jsonl.gz old.py Debreselam.py  # compare two versions
+    options: --speed N (0 = as fast as possible, 1 = original timing)
+             --api-latency MS (simulated Bot API round trip)
+"""
+
+import os
+import gzip
+import json
+import time
+import random
+import asyncio
+import inspect
+import argparse
+import importlib.util
+
+# Replays must never append to the log they are reading
+os.environ["TRAFFIC_LOG"] = ""
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "")
+
+from telegram import Update
+from telegram.request import BaseRequest
+from telegram.ext import (
+    Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+)
+
+STUB_TOKEN = "123456:replay"
+STUB_BOT = {"id": 123456, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+
+# ==================== STUB BOT API ====================
+class StubRequest(BaseRequest):
+    """Answers every Bot API call locally with a plausible result"""
+
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency
+        self.calls = {}
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params):
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "from": STUB_BOT, "text": params.get("text", "")}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        if "/file/bot" in url:  # file download
+            return 200, b"replayed file content"
+
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+
+        if api_method == "getMe":
+            result = STUB_BOT
+        elif api_method == "getFile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": "replay",
+                      "file_size": 21, "file_path": "replay/file.bin"}
+        elif api_method.startswith(("send", "edit")):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+# ==================== REPLAY ====================
+def load_log(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    # Logged in handling order; replay in arrival order
+    return sorted(records, key=lambda record: record["t"])
+
+def load_bot_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    accept_redacted_passwords(module)
+    return module
+
+def accept_redacted_passwords(module):
+    """Passwords are redacted in the log; accept the placeholder so sessions get past login"""
+    db_class = getattr(module, "SimpleDB", None)
+    if db_class is None:
+        return
+    redacted = getattr(module, "REDACTED_TEXT", "******")
+    verify_password = db_class.verify_password
+
+    def verify_or_redacted(self, user_id, password):
+        if password == redacted:
+            return self.get_user(user_id) is not None
+        return verify_password(self, user_id, password)
+
+    db_class.verify_password = verify_or_redacted
+
+def resolve_pseudonyms(records, module):
+    """School IDs are pseudonymised in the log; map each one to a seeded user with the same role prefix"""
+    by_prefix = {}
+    for user_id in sorted(module.SimpleDB().users):
+        by_prefix.setdefault(user_id[:3], []).append(user_id)
+
+    def real_id(match):
+        candidates = by_prefix.get(match.group(1))
+        return candidates[int(match.group(2), 16) % len(candidates)] if candidates else match.group(0)
+
+    for record in records:
+        update = record["update"]
+        if "text" in update.get("message", {}):
+            update["message"]["text"] = module.PSEUDONYM_PATTERN.sub(real_id, update["message"]["text"])
+        if "data" in update.get("callback_query", {}):
+            update["callback_query"]["data"] = module.PSEUDONYM_PATTERN.sub(real_id, update["callback_query"]["data"])
+    return records
+
+def lift_tenant_budgets(module):
+    """Older versions throttle inside a handler; give every tenant an unlimited budget"""
+    registry = getattr(module, "tenants", None)
+    for tenant in getattr(registry, "tenants", {}).values():
+        tenant.rate_per_second = tenant.burst = tenant.tokens = float("inf")
+
+def build_application(module, request):
+    # Throttling is off: a replay at full speed would otherwise time the busy path
+    if hasattr(module, "build_application"):
+        if "throttle" in inspect.signature(module.build_application).parameters:
+            return module.build_application(STUB_TOKEN, request=request, throttle=False)
+        lift_tenant_budgets(module)
+        return module.build_application(STUB_TOKEN, request=request)
+
+    # Older versions wired their handlers inside main()
+    app = Application.builder().token(STUB_TOKEN).request(request).build()
+    app.add_handler(CommandHandler("start", module.start_command))
+    app.add_handler(CallbackQueryHandler(module.handle_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, module.handle_message))
+    app.add_handler(MessageHandler(filters.CONTACT, module.handle_contact))
+    app.add_error_handler(module.error_handler)
+    return app
+
+def update_route(route_callback, update):
+    if update.callback_query:
+        return route_callback(update.callback_query.data or "")
+
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        return message.text.split()[0].split("@")[0]
+    for kind in ("photo", "document", "contact"):
+        if getattr(message, kind):
+            return f"message:{kind}"
+    return "message:text"
+
+async def replay(module, records, speed, api_latency, route_callback):
+    # Same seed for every version so quizzes draw the same questions
+    random.seed(0)
+    request = StubRequest(api_latency)
+    app = build_application(module, request)
+    await app.initialize()
+    await app.start()
+
+    latencies = {}
+    unanswered = 0
+    started = time.monotonic()
+    try:
+        for record in records:
+            if speed > 0:
+                delay = record["t"] / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            update = Update.de_json(record["update"], app.bot)
+            route = update_route(route_callback, update)
+            calls_before = sum(request.calls.values())
+            begin = time.perf_counter()
+            await app.update_processor.process_update(update, app.process_update(update))
+            latencies.setdefault(route, []).append(time.perf_counter() - begin)
+            if sum(request.calls.values()) == calls_before:
+                unanswered += 1
+    finally:
+        await app.stop()
+        await app.shutdown()
+    registry = getattr(module, "tenants", None)
+    dropped = sum(getattr(tenant, "dropped", 0) for tenant in getattr(registry, "tenants", {}).values())
+    return latencies, request.calls, dropped, unanswered
+
+# ==================== REPORT ====================
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def print_report(results, labels):
+    routes = sorted({route for latencies, *_ in results for route in latencies})
+    header = f"{'route':<22} {'calls':>6}"
+    for label in labels:
+        header += f" {label + ' p50':>12} {label + ' p95':>12}"
+    if len(results) == 2:
+        header += f" {'Δ p50':>9} {'Δ p95':>9}"
+    print(header)
+    print("-" * len(header))
+
+    for route in routes:
+        row = f"{route:<22} {len(results[0][0].get(route, [])):>6}"
+        stats = []
+        for latencies, *_ in results:
+            values = latencies.get(route)
+            if values:
+                p50, p95 = percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000
+                stats.append((p50, p95))
+                row += f" {p50:>10.2f}ms {p95:>10.2f}ms"
+            else:
+                stats.append(None)
+                row += f" {'-':>12} {'-':>12}"
+        if len(results) == 2 and stats[0] and stats[1]:
+            for i in range(2):
+                change = (stats[1][i] - stats[0][i]) / stats[0][i] * 100 if stats[0][i] else 0
+                row += f" {change:>+8.1f}%"
+        print(row)
+
+    for label, (_, calls, dropped, unanswered) in zip(labels, results):
+        print(f"\n{label} Bot API calls: {sum(calls.values())} {dict(sorted(calls.items()))}")
+        print(f"{label} updates dropped: {dropped}, without any Bot API call: {unanswered}")
+        if dropped:
+            print(f"⚠️ {label} dropped updates, so its latencies do not cover the whole log")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured bot traffic")
+    parser.add_argument("log", help="gzip JSON-lines file written via TRAFFIC_LOG")
+    parser.add_argument("versions", nargs="*", help="one or two bot files (default: Debreselam.py)")
+    parser.add_argument("--speed", type=float, default=0, help="0 = as fast as possible, 1 = original timing")
+    parser.add_argument("--api-latency", type=float, default=0, help="simulated Bot API latency in ms")
+    args = parser.parse_args()
+
+    versions = args.versions or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "Debreselam.py")]
+    if len(versions) > 2:
+        parser.error("compare at most two versions")
+
+    records = load_log(args.log)
+    print(f"🔁 Replaying {len(records)} updates at {'max' if not args.speed else f'{args.speed}x'} speed")
+
+    labels = ["A", "B"][:len(versions)]
+    modules = [load_bot_module(path, f"replayed_bot_{label}") for label, path in zip(labels, versions)]
+    # Group callbacks the same way for both versions, using the newest grouping available
+    route_callback = next((module.callback_route for module in reversed(modules)
+                           if hasattr(module, "callback_route")), lambda data: data)
+    pseudonym_module = next((module for module in reversed(modules) if hasattr(module, "PSEUDONYM_PATTERN")), None)
+    if pseudonym_module:
+        records = resolve_pseudonyms(records, pseudonym_module)
+
+    results = []
+    for label, path, module in zip(labels, versions, modules):
+        print(f"▶️ {label}: {path}")
+        results.append(asyncio.run(replay(module, records, args.speed, args.api_latency / 1000, route_callback)))
+
+    print()
+    print_report(results, labels)
+
+if __name__ == '__main__':
+    main()
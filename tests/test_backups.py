@@ -0,0 +1,179 @@
+import asyncio
+import os
+
+import pytest
+
+import Debreselam
+from Debreselam import BackupManager, SimpleDB
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_writes(monkeypatch):
+    monkeypatch.setattr(Debreselam, "BACKUP_MAX_BYTES_PER_SECOND", 1 << 40)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_chain(directory):
+    """Full snapshot, then two incrementals: a password change, then attendance"""
+    db = SimpleDB()
+    backups = BackupManager(str(directory))
+    full = run(backups.backup(db))
+    db.update_password("STS0001", "changed1")
+    password = run(backups.backup(db))
+    db.record_attendance("STS0002")
+    db.assign_homework("ቀዳማይ", "Bible", "TCH1001")
+    attendance = run(backups.backup(db))
+    return backups, [full, password, attendance]
+
+
+def test_first_backup_is_full_and_later_ones_incremental(tmp_path):
+    backups, snapshots = make_chain(tmp_path)
+    assert [snapshot["full"] for snapshot in snapshots] == [True, False, False]
+    assert snapshots[1]["records"] == 1
+    manifest = backups.load_manifest()
+    assert [snapshot["id"] for snapshot in manifest["snapshots"]] == [1, 2, 3]
+    assert all(os.path.exists(tmp_path / snapshot["file"]) for snapshot in manifest["snapshots"])
+
+
+def test_no_changes_means_no_snapshot(tmp_path):
+    db = SimpleDB()
+    backups = BackupManager(str(tmp_path))
+    run(backups.backup(db))
+    assert run(backups.backup(db)) is None
+
+
+def test_restore_replays_the_whole_chain(tmp_path):
+    backups, _ = make_chain(tmp_path)
+    db = SimpleDB()
+    run(backups.restore(db, 3))
+    assert db.verify_password("STS0001", "changed1")
+    assert list(db.users["STS0002"]["attendance_days"].values()) == [True]
+    assert [hw["subject"] for hw in db.homework] == ["Bible"]
+    assert db.search("sarah")
+
+
+def test_restore_to_a_middle_snapshot(tmp_path):
+    backups, _ = make_chain(tmp_path)
+    db = SimpleDB()
+    run(backups.restore(db, 2))
+    assert db.verify_password("STS0001", "changed1")
+    assert "attendance_days" not in db.users["STS0002"]
+    assert db.homework == []
+
+
+def test_restore_forces_the_next_backup_to_be_full(tmp_path):
+    backups, _ = make_chain(tmp_path)
+    db = SimpleDB()
+    run(backups.restore(db, 2))
+    assert run(backups.backup(db))["full"]
+
+
+def test_checksum_failure_is_refused(tmp_path):
+    backups, snapshots = make_chain(tmp_path)
+    path = tmp_path / snapshots[1]["file"]
+    payload = bytearray(path.read_bytes())
+    payload[-1] ^= 0xFF
+    path.write_bytes(bytes(payload))
+
+    db = SimpleDB()
+    with pytest.raises(ValueError, match="checksum"):
+        run(backups.restore(db, 3))
+    assert db.verify_password("STS0001", "student123")
+    # Snapshots before the damaged one still restore
+    run(backups.restore(db, 1))
+
+
+def test_unknown_snapshot(tmp_path):
+    backups, _ = make_chain(tmp_path)
+    with pytest.raises(ValueError, match="not found"):
+        run(backups.restore(SimpleDB(), 7))
+
+
+def test_failed_write_starts_a_new_chain(tmp_path):
+    db = SimpleDB()
+    backups = BackupManager(str(tmp_path))
+    run(backups.backup(db))
+    db.update_password("STS0001", "changed1")
+
+    def fail(changes):
+        raise OSError("disk full")
+    backups._write_snapshot = fail
+    with pytest.raises(OSError):
+        run(backups.backup(db))
+    del backups._write_snapshot
+
+    snapshot = run(backups.backup(db))
+    assert snapshot["full"]
+    restored = SimpleDB()
+    run(backups.restore(restored, snapshot["id"]))
+    assert restored.verify_password("STS0001", "changed1")
+
+
+def test_chat_tenants_survive_a_restore(tmp_path):
+    db = SimpleDB()
+    backups = BackupManager(str(tmp_path))
+    run(backups.backup(db))
+    db.set_chat_tenant(42, "st_mary")
+    snapshot = run(backups.backup(db))
+
+    restored = SimpleDB()
+    run(backups.restore(restored, snapshot["id"]))
+    assert restored.get_chat_tenant(42) == "st_mary"
+
+
+def test_digest_progress_is_backed_up(tmp_path):
+    db = SimpleDB()
+    db.users["PAR2001"]["chat_id"] = 5
+    backups = BackupManager(str(tmp_path))
+    db.record_attendance("STS0001")
+    run(backups.backup(db))
+    assert len(db.collect_digests()) == 1
+
+    snapshot = run(backups.backup(db))
+    assert snapshot is not None
+    restored = SimpleDB()
+    run(backups.restore(restored, snapshot["id"]))
+    assert restored.collect_digests() == []
+
+
+def test_full_backup_trims_digested_changes(tmp_path):
+    db = SimpleDB()
+    db.users["PAR2001"]["chat_id"] = 5
+    backups = BackupManager(str(tmp_path))
+    db.record_attendance("STS0001")
+    db.collect_digests()
+    db.set_grade("STS0001", "Bible", 70)
+
+    snapshot = run(backups.backup(db))
+    assert snapshot["full"]
+    assert [event["type"] for event in db.change_log] == ["grade"]
+    assert db.digest_cursor == 0
+
+    restored = SimpleDB()
+    run(backups.restore(restored, snapshot["id"]))
+    due = restored.collect_digests()
+    assert [event["type"] for event in due[0][2]["STS0001"]] == ["grade"]
+
+
+def test_large_export_yields_to_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(Debreselam, "BACKUP_EXPORT_SLICE", 2)
+    db = SimpleDB()
+    ticks = []
+
+    async def export_while_ticking():
+        async def tick():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0)
+        changes = await db.export_changes(full=True)
+        ticker.cancel()
+        return changes
+
+    changes = run(export_while_ticking())
+    assert set(changes["records"]["users"]) == set(db.users)
+    assert len(ticks) > 2
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from Debreselam import ContentWatcher, SimpleDB
+
+
+def write_json(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    # Bump the mtime explicitly; rewrites within one clock tick would look unchanged
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def question(text, answer="4"):
+    return {"question": text, "options": ["3", "4", "5"], "answer": answer}
+
+
+def make_content(tmp_path):
+    write_json(tmp_path / "quiz_questions" / "math.json",
+               {"subject": "math", "title": "Mathematics", "questions": [question("What is 2 + 2?")]})
+    write_json(tmp_path / "study_materials" / "class_1.json",
+               {"class": "ቀዳማይ", "materials": ["Bible Stories", "ፊደል"]})
+    write_json(tmp_path / "schedule.json", {"days": [{"day": "Sunday", "items": ["9:00 - Bible"]}]})
+    db = SimpleDB()
+    watcher = ContentWatcher(str(tmp_path))
+    watcher.load(db)
+    return db, watcher
+
+
+def search_ids(db, query):
+    return [result["id"] for result in db.search(query)]
+
+
+def test_initial_load(tmp_path):
+    db, _ = make_content(tmp_path)
+    assert db.quiz_titles == {"math": "Mathematics"}
+    assert db.study_materials == {"ቀዳማይ": ["Bible Stories", "ፊደል"]}
+    assert db.schedule == [{"day": "Sunday", "items": ["9:00 - Bible"]}]
+    assert search_ids(db, "ፊደ") == ["material:ቀዳማይ:1"]
+
+
+def test_unchanged_files_are_not_reloaded(tmp_path):
+    db, watcher = make_content(tmp_path)
+    assert asyncio.run(watcher.reload(db)) == 0
+
+
+def test_edited_file_is_reloaded_and_reindexed(tmp_path):
+    db, watcher = make_content(tmp_path)
+    old_questions = db.quiz_questions["math"]
+    write_json(tmp_path / "quiz_questions" / "math.json",
+               {"subject": "math", "questions": [question("What is 1 + 3?"), question("What is 9 - 5?")]})
+
+    assert asyncio.run(watcher.reload(db)) == 1
+    assert [q["question"] for q in db.quiz_questions["math"]] == ["What is 1 + 3?", "What is 9 - 5?"]
+    # Running quizzes keep the list they started with
+    assert [q["question"] for q in old_questions] == ["What is 2 + 2?"]
+    assert search_ids(db, "2") == []
+    assert len(search_ids(db, "what")) == 2
+
+
+def test_removed_file_drops_its_content(tmp_path):
+    db, watcher = make_content(tmp_path)
+    os.remove(tmp_path / "study_materials" / "class_1.json")
+
+    assert asyncio.run(watcher.reload(db)) == 1
+    assert db.study_materials == {}
+    assert search_ids(db, "bible") == []
+    assert "math" in db.quiz_questions
+
+
+def test_renamed_key_replaces_the_old_one(tmp_path):
+    db, watcher = make_content(tmp_path)
+    write_json(tmp_path / "study_materials" / "class_1.json",
+               {"class": "ካልኣይ", "materials": ["Psalms"]})
+
+    asyncio.run(watcher.reload(db))
+    assert db.study_materials == {"ካልኣይ": ["Psalms"]}
+    assert search_ids(db, "stories") == []
+
+
+def test_broken_file_keeps_the_previous_version(tmp_path):
+    db, watcher = make_content(tmp_path)
+    write_json(tmp_path / "quiz_questions" / "math.json",
+               {"subject": "math", "questions": [question("What is 2 + 2?", answer="7")]})
+
+    asyncio.run(watcher.reload(db))
+    assert db.quiz_questions["math"][0]["answer"] == "4"
+    # Not retried until the file changes again
+    assert asyncio.run(watcher.reload(db)) == 0
+
+
+@pytest.mark.parametrize("name, data", [
+    ("schedule.json", {"days": ["Sunday: Bible"]}),
+    ("schedule.json", {"days": [{"day": "Sunday", "items": "9:00 - Bible"}]}),
+    ("schedule.json", {"days": [{"items": []}]}),
+    ("study_materials/class_1.json", {"class": "ቀዳማይ", "materials": [{"title": "Psalms"}]}),
+    ("quiz_questions/math.json", {"subject": "math", "questions": [{"question": "?", "options": "4", "answer": "4"}]}),
+])
+def test_malformed_files_keep_the_previous_version(tmp_path, name, data):
+    db, watcher = make_content(tmp_path)
+    before = (db.schedule, dict(db.study_materials), dict(db.quiz_questions))
+    write_json(tmp_path / name, data)
+
+    asyncio.run(watcher.reload(db))
+    assert (db.schedule, db.study_materials, db.quiz_questions) == before
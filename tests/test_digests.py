@@ -0,0 +1,71 @@
+import Debreselam
+from Debreselam import SimpleDB
+
+
+def linked_db():
+    db = SimpleDB()
+    db.link_chat("PAR2001", 5)
+    return db
+
+
+def event_types(digest):
+    return [(event["type"], event["detail"]) for event in digest]
+
+
+def test_changes_are_batched_per_child():
+    db = linked_db()
+    db.record_attendance("STS0001")
+    db.set_grade("STS0001", "Math", 75)
+    db.record_attendance("STS0002")  # not this parent's child
+    db.assign_homework("ቀዳማይ", "Bible", "TCH1001")
+    db.assign_homework("ካልኣይ", "Bible", "TCH1001")
+
+    (parent_id, _, children), = db.collect_digests()
+    assert parent_id == "PAR2001"
+    assert list(children) == ["STS0001"]
+    assert event_types(children["STS0001"]) == [
+        ("attendance", {"present": True}),
+        ("grade", {"subject": "Math", "grade": 75}),
+        ("homework", {"subject": "Bible"}),
+    ]
+    # Each change is delivered once
+    assert db.collect_digests() == []
+
+
+def test_repeated_attendance_and_unchanged_grades_are_not_repeated():
+    db = linked_db()
+    db.record_attendance("STS0001")
+    db.record_attendance("STS0001")
+    db.set_grade("STS0001", "Math", 90)  # already 90
+    (_, _, children), = db.collect_digests()
+    assert event_types(children["STS0001"]) == [("attendance", {"present": True})]
+
+
+def test_weekly_parents_wait_for_the_weekly_run():
+    db = linked_db()
+    db.set_digest_frequency("PAR2001", "weekly")
+    db.record_attendance("STS0001")
+    db.collect_digests()
+    db.set_grade("STS0001", "Bible", 60)
+    assert db.collect_digests() == []
+
+    (_, _, children), = db.collect_digests(include_weekly=True)
+    assert [event["type"] for event in children["STS0001"]] == ["attendance", "grade"]
+
+
+def test_unlinked_parents_keep_only_recent_changes(monkeypatch):
+    monkeypatch.setattr(Debreselam, "DIGEST_MAX_PENDING", 3)
+    db = SimpleDB()
+    for grade in range(10):
+        db.set_grade("STS0001", "Math", grade)
+        assert db.collect_digests() == []
+    pending = db.pending_digests["PAR2001"]["STS0001"]
+    assert [event["detail"]["grade"] for event in pending] == [7, 8, 9]
+
+
+def test_grade_subjects_map_onto_existing_keys():
+    db = SimpleDB()
+    assert db.match_grade_subject("Mathematics") == "Math"
+    assert db.match_grade_subject("math") == "Math"
+    assert db.match_grade_subject("BIBLE") == "Bible"
+    assert db.match_grade_subject("Geography") is None
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import pytest
+
+import Debreselam
+from Debreselam import ReportCache, Tenant, use_tenant
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+    render_report = Debreselam.render_report
+
+    def counting_render(*args):
+        calls.append(args[2])
+        return render_report(*args)
+    monkeypatch.setattr(Debreselam, "render_report", counting_render)
+    # The default thread pool is enough here; no worker processes to spawn
+    monkeypatch.setattr(Debreselam, "get_process_pool", lambda: None)
+    return calls
+
+
+@pytest.fixture
+def tenant(monkeypatch, tmp_path):
+    monkeypatch.setattr(Debreselam, "BACKUP_DIR", str(tmp_path / "backups"))
+    return Tenant("reports_test")
+
+
+def fetch(tenant, cache, *requests):
+    async def run():
+        use_tenant(tenant)
+        return await asyncio.gather(*(cache.get_report(tenant.tenant_id, "summary", "csv", class_name)
+                                      for class_name in requests))
+    return asyncio.run(run())
+
+
+def test_report_is_rendered_once_and_reused(tmp_path, tenant, renders):
+    cache = ReportCache(str(tmp_path))
+    first, second = fetch(tenant, cache, "ቀዳማይ", "ቀዳማይ")
+    assert first is second
+    assert fetch(tenant, cache, "ቀዳማይ")[0] is first
+    assert renders == ["ቀዳማይ"]
+    with open(first["path"], encoding="utf-8") as f:
+        assert "ሚካኤል አለማየሁ" in f.read()
+
+
+def test_grade_change_invalidates_only_that_class(tmp_path, tenant, renders):
+    cache = ReportCache(str(tmp_path))
+    old, other = fetch(tenant, cache, "ቀዳማይ", "ካልኣይ")
+    tenant.db.set_grade("STS0001", "Math", 42)
+
+    new, other_again = fetch(tenant, cache, "ቀዳማይ", "ካልኣይ")
+    assert new is not old and other_again is other
+    assert not os.path.exists(old["path"])
+    with open(new["path"], encoding="utf-8") as f:
+        assert "42" in f.read()
+    assert sorted(renders) == sorted(["ቀዳማይ", "ካልኣይ", "ቀዳማይ"])
+
+
+def test_unchanged_values_keep_the_cache(tmp_path, tenant, renders):
+    cache = ReportCache(str(tmp_path))
+    tenant.db.record_attendance("STS0001")
+    entry = fetch(tenant, cache, "ቀዳማይ")[0]
+    tenant.db.record_attendance("STS0001")
+    tenant.db.set_grade("STS0001", "Math", 90)
+    assert fetch(tenant, cache, "ቀዳማይ")[0] is entry
+
+
+def test_attendance_and_restores_invalidate(tmp_path, tenant, renders):
+    cache = ReportCache(str(tmp_path))
+    first = fetch(tenant, cache, "ቀዳማይ")[0]
+    tenant.db.record_attendance("STS0001")
+    second = fetch(tenant, cache, "ቀዳማይ")[0]
+    tenant.db.data_epoch += 1  # what load_state does after a restore
+    third = fetch(tenant, cache, "ቀዳማይ")[0]
+    assert len({first["path"], second["path"], third["path"]}) == 3
+    assert len(renders) == 3
@@ -0,0 +1,64 @@
+from Debreselam import SearchIndex, tokenize
+
+
+def make_index():
+    index = SearchIndex()
+    index.add("user:STS0001", "user", "ሚካኤል አለማየሁ", "ቀዳማይ", "STS0001")
+    index.add("user:STS0002", "user", "Sarah Johnson", "ካልኣይ", "STS0002")
+    index.add("user:STS0003", "user", "Samuel Bekele", "ቀዳማይ", "STS0003")
+    index.add("material:ቀዳማይ:0", "material", "ቅዱስ፡ሚካኤል፡ታሪክ", "ቀዳማይ")
+    return index
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+def test_tokenize_splits_on_ethiopic_punctuation():
+    assert tokenize("ቅዱስ፡ሚካኤል። Sarah, JOHNSON") == ["ቅዱስ", "ሚካኤል", "sarah", "johnson"]
+
+
+def test_prefix_search_matches_every_term_with_the_prefix():
+    index = make_index()
+    assert set(ids(index.search("sa"))) == {"user:STS0002", "user:STS0003"}
+    assert ids(index.search("sar")) == ["user:STS0002"]
+
+
+def test_geez_prefix_and_whole_word_search():
+    index = make_index()
+    assert set(ids(index.search("ሚካ"))) == {"user:STS0001", "material:ቀዳማይ:0"}
+    assert ids(index.search("ታሪክ")) == ["material:ቀዳማይ:0"]
+
+
+def test_every_query_token_must_match():
+    index = make_index()
+    assert ids(index.search("sarah johnson")) == ["user:STS0002"]
+    assert index.search("sarah bekele") == []
+
+
+def test_exact_match_outranks_prefix_match():
+    index = SearchIndex()
+    index.add("a", "material", "Psalms of David")
+    index.add("b", "material", "Psalm")
+    assert ids(index.search("psalm")) == ["b", "a"]
+
+
+def test_kinds_filter():
+    index = make_index()
+    assert ids(index.search("ሚካኤል", kinds={"material"})) == ["material:ቀዳማይ:0"]
+
+
+def test_remove_drops_unused_terms():
+    index = make_index()
+    assert index.remove("user:STS0002")
+    assert index.search("sarah") == []
+    assert "sarah" not in index.terms and "johnson" not in index.terms
+    assert "ካልኣይ" not in index.postings
+    assert not index.remove("user:STS0002")
+
+
+def test_readding_a_document_replaces_it():
+    index = make_index()
+    index.add("user:STS0002", "user", "Sara Tesfaye", "ካልኣይ", "STS0002")
+    assert index.search("johnson") == []
+    assert ids(index.search("tesfaye")) == ["user:STS0002"]
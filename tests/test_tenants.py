@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+from telegram import Update
+
+import Debreselam
+from Debreselam import TenantRegistry, TenantUpdateProcessor
+
+
+@pytest.fixture
+def registry():
+    registry = TenantRegistry(["default", "st_mary", "st_george"], "default", {"st_george": "1907"})
+    registry.join(1, "st_mary")
+    return registry
+
+
+def message(chat_id, update_id):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "hi",
+        "chat": {"id": chat_id, "type": "private"}}}, None)
+
+
+async def handled(log, name):
+    log.append((name, time.monotonic()))
+
+
+def test_join_codes(registry):
+    assert registry.resolve(1).tenant_id == "st_mary"
+    assert registry.resolve(2).tenant_id == "default"
+    assert registry.join(2, "st_george") is None
+    assert registry.join(2, "st_george-0000") is None
+    assert registry.join(2, "nowhere") is None
+    assert registry.resolve(2).tenant_id == "default"
+    assert registry.join(2, "st_george-1907").tenant_id == "st_george"
+    assert registry.default.db.get_chat_tenant(2) == "st_george"
+
+
+def test_token_bucket(registry):
+    tenant = registry.get("st_mary")
+    tenant.burst = tenant.tokens = 3
+    assert [tenant.allow_update() for _ in range(4)] == [True, True, True, False]
+
+
+def test_busy_tenant_waits_without_blocking_others(registry, monkeypatch):
+    replies = []
+    monkeypatch.setattr(TenantUpdateProcessor, "reply_busy", staticmethod(handled.__get__(replies)))
+    monkeypatch.setattr(Debreselam, "TENANT_MAX_WAITING", 10)
+    busy = registry.get("st_mary")
+    busy.rate_per_second, busy.burst, busy.tokens = 20, 1, 1
+
+    async def flood():
+        processor = TenantUpdateProcessor(registry)
+        log = []
+        started = time.monotonic()
+        updates = [processor.process_update(message(1, i), handled(log, "busy")) for i in range(30)]
+        other = processor.process_update(message(2, 99), handled(log, "other"))
+        await asyncio.gather(*updates, other)
+        await asyncio.sleep(0)
+        return log, started, processor
+
+    log, started, processor = asyncio.run(flood())
+    other_at = next(at for name, at in log if name == "other")
+    assert other_at - started < 0.1
+    # The chat's queued updates count toward the limit; the rest are turned away, not lost silently
+    assert sum(1 for name, _ in log if name == "busy") == 30 - busy.dropped
+    assert busy.dropped >= 19 and len(replies) == busy.dropped
+    assert busy.waiting == 0 and processor.chat_locks == {}
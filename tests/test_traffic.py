@@ -0,0 +1,89 @@
+import gzip
+import json
+
+import pytest
+from telegram import Update
+
+import Debreselam
+from Debreselam import REDACTED_TEXT, TrafficRecorder
+
+USER = {"id": 5551234, "is_bot": False, "first_name": "Sarah", "username": "sarah_j"}
+CHAT = {"id": 5551234, "type": "private", "first_name": "Sarah"}
+
+
+def message_update(key="message", **fields):
+    message = {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, **fields}
+    return Update.de_json({"update_id": 1, key: message}, None)
+
+
+def callback_update(data):
+    return Update.de_json({"update_id": 2, "callback_query": {
+        "id": "9", "from": USER, "chat_instance": "c", "data": data,
+        "message": {"message_id": 3, "date": 0, "chat": CHAT, "text": "📊 Sarah Johnson: Math 88"}}}, None)
+
+
+@pytest.fixture
+def capture(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl.gz"), salt="fixed")
+
+    def record(update, expecting=None):
+        recorder.record(update, expecting)
+        recorder.close()
+        with gzip.open(recorder.path, "rt", encoding="utf-8") as f:
+            return [json.loads(line)["update"] for line in f][-1]
+    return record
+
+
+def test_user_details_are_anonymized(capture):
+    data = capture(message_update(text="hello"))
+    assert data["message"]["from"]["id"] != USER["id"]
+    assert data["message"]["from"]["first_name"] == "anon"
+    assert data["message"]["chat"]["id"] == data["message"]["from"]["id"]
+    assert "sarah" not in json.dumps(data).lower()
+
+
+@pytest.mark.parametrize("key", ["message", "edited_message"])
+@pytest.mark.parametrize("state", ["password", "new_password", "search_query", "manual_contact"])
+def test_sensitive_text_is_redacted(capture, key, state):
+    data = capture(message_update(key, text="MySecret99"), expecting=state)
+    assert data[key]["text"] == REDACTED_TEXT
+
+
+def test_captions_are_redacted(capture):
+    data = capture(message_update(caption="Sarah Johnson's homework",
+                                  photo=[{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]))
+    assert data["message"]["caption"] == REDACTED_TEXT
+
+
+def test_school_ids_are_pseudonymised_consistently(capture):
+    first = capture(message_update(text="sts0001 "), expecting="user_id")["message"]["text"]
+    again = capture(message_update(text="STS0001"), expecting="user_id")["message"]["text"]
+    assert first == again
+    assert Debreselam.PSEUDONYM_PATTERN.fullmatch(first).group(1) == "STS"
+    assert capture(message_update(text="my name is Sarah"), expecting="user_id")["message"]["text"] == REDACTED_TEXT
+
+    data = capture(callback_update("grade_STS0001"))
+    assert data["callback_query"]["data"] == f"grade_{first}"
+    assert "text" not in data["callback_query"]["message"]
+
+
+def test_search_arguments_are_redacted(capture):
+    data = capture(message_update(text="/search Sarah",
+                                  entities=[{"type": "bot_command", "offset": 0, "length": 7}]))
+    assert data["message"]["text"] == f"/search {REDACTED_TEXT}"
+
+
+def test_replay_maps_pseudonyms_to_seeded_users(capture):
+    import replay
+    text = capture(message_update(text="TCH1001"), expecting="user_id")["message"]["text"]
+    records = replay.resolve_pseudonyms([{"t": 0, "update": {"message": {"text": text}}}], Debreselam)
+    assert records[0]["update"]["message"]["text"] == "TCH1001"
+
+
+def test_arrival_time_is_logged_not_handling_time(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl.gz"), salt="fixed")
+    recorder.record(message_update(text="first"), arrived=100.0)
+    recorder.record(message_update(text="queued"), arrived=100.5)
+    recorder.close()
+    with gzip.open(recorder.path, "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["t"] for line in f] == [0, 0.5]